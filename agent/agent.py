@@ -6,11 +6,114 @@ from datetime import datetime, timezone
 import re
 import json
 import random
+import os
+import sys
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import hashlib
+import bisect
+import itertools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
 from string import Template
 
 MODEL = "llama-v3p1-70b-instruct"
 CLOB_ENDPOINT = 'https://clob.polymarket.com'
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# How many items of a large dict/list to show when it is summarized
+LOG_SUMMARY_ITEMS = int(os.getenv("LOG_SUMMARY_ITEMS", "5"))
+LOG_SUMMARY_CHARS = int(os.getenv("LOG_SUMMARY_CHARS", "200"))
+
+# On-disk cache of parsed gamma-api responses and LLM completions, shared by agent runs on the same host
+EVENT_CACHE_DIR = os.getenv("EVENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "smartpool-agent-cache"))
+# Seconds a cached response is used without asking the server; after that it is revalidated
+EVENT_CACHE_TTL = float(os.getenv("EVENT_CACHE_TTL", "60"))
+EVENT_CACHE_MAX_BYTES = int(os.getenv("EVENT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Most token IDs sent in one /books request, and how many requests run at once
+BOOKS_CHUNK_SIZE = int(os.getenv("BOOKS_CHUNK_SIZE", "20"))
+BOOKS_FETCH_WORKERS = int(os.getenv("BOOKS_FETCH_WORKERS", "4"))
+
+# Batch mode: markets analyzed at once, and LLM completions allowed in flight at once
+AGENT_BATCH_WORKERS = int(os.getenv("AGENT_BATCH_WORKERS", "8"))
+AGENT_COMPLETION_CONCURRENCY = int(os.getenv("AGENT_COMPLETION_CONCURRENCY", "2"))
+
+# A cached completion is reused while no bid/ask has moved more than this
+# (prices are 0-1) and it is younger than PREDICTION_CACHE_MAX_AGE seconds
+PREDICTION_CACHE_THRESHOLD = float(os.getenv("PREDICTION_CACHE_THRESHOLD", "0.01"))
+PREDICTION_CACHE_MAX_AGE = float(os.getenv("PREDICTION_CACHE_MAX_AGE", "3600"))
+# Stream completions (when the environment supports it) so predictions are parsed as they arrive
+AGENT_STREAM_COMPLETIONS = os.getenv("AGENT_STREAM_COMPLETIONS", "1") == "1"
+
+# Ask the LLM for the recommended action instead of sizing it locally (see kelly_recommendation)
+AGENT_LLM_RECOMMENDATION = os.getenv("AGENT_LLM_RECOMMENDATION", "0") == "1"
+# Fraction of the full Kelly stake to bet, and the most of usdc_available one market may hold
+KELLY_FRACTION = float(os.getenv("KELLY_FRACTION", "0.25"))
+KELLY_MAX_POSITION = float(os.getenv("KELLY_MAX_POSITION", "0.2"))
+# Smallest gap between predicted probability and price worth trading on
+KELLY_MIN_EDGE = float(os.getenv("KELLY_MIN_EDGE", "0.02"))
+
+# Approximate token budget for the event, market and price sections of the prediction prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Notes are trimmed to this many tokens before any open, liquid market is dropped
+PROMPT_MIN_NOTES_TOKENS = int(os.getenv("PROMPT_MIN_NOTES_TOKENS", "300"))
+
+class SampleFilter(logging.Filter):
+    """Records logged with extra={"sample": N} are only written once every N calls from that line."""
+    def __init__(self):
+        super().__init__()
+        self.counts = defaultdict(int)
+
+    def filter(self, record):
+        sample = getattr(record, "sample", None)
+        if not sample or sample <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        self.counts[key] += 1
+        return self.counts[key] % sample == 1
+
+def setup_logging(level=LOG_LEVEL):
+    """
+    Logs through a queue drained by a background listener thread, so writing
+    to stdout never blocks the agent. Returns the logger.
+    """
+    log = logging.getLogger("agent")
+    log.setLevel(level)
+    log.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)-7s | %(funcName)s:%(lineno)d | %(message)s"))
+    handler.addFilter(SampleFilter())
+    log_queue = queue.SimpleQueue()
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return log
+
+logger = setup_logging()
+
+def summarize(value, items=LOG_SUMMARY_ITEMS, chars=LOG_SUMMARY_CHARS):
+    """Short description of a (possibly large) object. At DEBUG level the object is returned in full."""
+    if logger.isEnabledFor(logging.DEBUG):
+        return value
+    if isinstance(value, dict):
+        keys = list(value)
+        shown = ", ".join(str(key) for key in keys[:items])
+        more = f", ... +{len(keys) - items}" if len(keys) > items else ""
+        return f"<dict {len(keys)} keys: {shown}{more}>"
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} {len(value)} items>"
+    text = str(value)
+    if len(text) > chars:
+        return f"{text[:chars]}... <{len(text)} chars>"
+    return text
+
 def parse_recommended_action(text):
     # Define a regular expression pattern to capture the action, amount, and question
     pattern = r'(?P<action>\w+)\s+(?P<amount>\d+)\s+"(?P<question>.+?)"'
@@ -42,7 +145,7 @@ def send_callback(pool_name, callback_url, prediction_market_url, recommended_ac
     :return: Response data if successful, None otherwise.
     """
     if not callback_url:
-        print("Callback URL not set.")
+        logger.warning("Callback URL not set.")
         return None
 
     # Prepare the payload
@@ -67,7 +170,7 @@ def send_callback(pool_name, callback_url, prediction_market_url, recommended_ac
     
     with urllib.request.urlopen(request) as response:
         response_data = response.read().decode('utf-8')
-        print("Response:", response_data)
+        logger.info("Callback response: %s", summarize(response_data))
         return response_data
 
 def render_template(context):
@@ -86,28 +189,242 @@ def render_template(context):
             template = Template(file.read())
             rendered_content = template.safe_substitute(context)
             env.write_file('index.html', rendered_content)
-        print("Rendered template from template.html to index.html successfully.")
+        logger.info("Rendered template from template.html to index.html successfully.")
     except FileNotFoundError:
-        print("Template file template.html not found.")
+        logger.error("Template file template.html not found.")
 
 model = "llama-v3p1-70b-instruct"
 
-def format_markets(parsed_data):
+def format_markets(parsed_data, include=None):
     """
     Formats the markets into a numbered list of questions with event data.
 
     Args:
         parsed_data: The list of parsed event dictionaries.
+        include: Optional set of market numbers to list; the others are left
+            out but keep their numbers, matching format_prices.
 
     Returns:
         A formatted string containing enumerated market questions.
     """
     formatted = []
+    idx = 0
     for event in parsed_data:
-        for idx, market in enumerate(event['markets'], 1):
-            formatted.append(f"{idx}. {market['question']}")
+        for market in event['markets']:
+            idx += 1
+            if include is None or idx in include:
+                formatted.append(f"{idx}. {market['question']}")
     return "\n".join(formatted)
 
+def count_tokens(text):
+    """Approximate LLM token count: one per word, number or punctuation mark, plus one per 8 characters of long words."""
+    return sum(1 + len(piece) // 8 for piece in re.findall(r"\w+|[^\w\s]", text))
+
+def dedupe_notes(notes):
+    """Drops repeated sentences (ignoring case and whitespace) from event notes."""
+    seen = set()
+    kept = []
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", notes or ""):
+        key = " ".join(sentence.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            kept.append(sentence.strip())
+    return " ".join(kept)
+
+def trim_to_tokens(text, max_tokens):
+    """Cuts text at a word boundary so it fits in max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + " ..."
+
+def market_liquidity(wall):
+    """Sort key, lowest for the least liquid market: (has both sides, -spread, top-of-book size)."""
+    bids, asks = wall if wall else ([], [])
+    if not bids or not asks:
+        return (0, 0.0, 0.0)
+    spread = float(asks[-1]['price']) - float(bids[-1]['price'])
+    size = sum(float(order.get('size', 0)) for order in bids + asks)
+    return (1, -spread, size)
+
+def build_prompt_sections(data, formatted_prices, walls, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Fits the event, market and price sections of the prompt into about
+    `budget` tokens. Notes are deduplicated; then, only while over budget,
+    closed markets and markets without a book are dropped, notes are cut to
+    PROMPT_MIN_NOTES_TOKENS, the least liquid markets are dropped (at least
+    one market is kept), and finally notes are cut further.
+
+    Remaining markets keep their original numbers, which the prediction
+    parser maps back to markets. Returns (formatted_event,
+    formatted_markets, formatted_prices, numbers of the included markets).
+    """
+    markets = [market for event in data for market in event['markets']]
+    price_lines = formatted_prices.split("\n")
+    events = [{**event, 'notes': dedupe_notes(event['notes'])} for event in data]
+    included = set(range(1, len(markets) + 1))
+
+    def render():
+        return (
+            format_events(events),
+            format_markets(events, included),
+            "\n".join(line for idx, line in enumerate(price_lines, 1) if idx in included),
+        )
+
+    def over_budget(sections):
+        return count_tokens("".join(sections)) > budget
+
+    def trim_notes(sections, floor):
+        other = count_tokens("".join(sections)) - sum(count_tokens(event['notes'] or "") for event in events)
+        per_event = max(floor, (budget - other) // max(1, len(events)))
+        for event in events:
+            event['notes'] = trim_to_tokens(event['notes'] or "", per_event)
+        return render()
+
+    def drop(candidates, sections):
+        for idx in candidates:
+            if not over_budget(sections) or len(included) == 1:
+                break
+            included.discard(idx)
+            sections = render()
+        return sections
+
+    def wall_at(idx):
+        return walls[idx - 1] if idx - 1 < len(walls) else None
+
+    sections = render()
+    if over_budget(sections):
+        inactive = [idx for idx in sorted(included) if markets[idx - 1]['closedTime'] is not None or market_liquidity(wall_at(idx))[0] == 0]
+        sections = drop(inactive, sections)
+    if over_budget(sections):
+        sections = trim_notes(sections, PROMPT_MIN_NOTES_TOKENS)
+    if over_budget(sections):
+        sections = drop(sorted(included, key=lambda idx: market_liquidity(wall_at(idx))), sections)
+    if over_budget(sections):
+        sections = trim_notes(sections, 0)
+    if len(included) < len(markets):
+        logger.info("Prompt budget: kept %d of %d markets", len(included), len(markets))
+    return (*sections, included)
+
+
+def _cache_path(url):
+    return os.path.join(EVENT_CACHE_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+def _read_cache(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _evict_cache(max_bytes=EVENT_CACHE_MAX_BYTES):
+    """Deletes the least recently used cache files until the cache fits in max_bytes."""
+    files = []
+    total = 0
+    for entry in os.scandir(EVENT_CACHE_DIR):
+        if entry.name.endswith(".json"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def _write_cache(path, entry):
+    os.makedirs(EVENT_CACHE_DIR, mode=0o700, exist_ok=True)
+    # A unique temp file per writer: batch mode writes from several threads at once
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=EVENT_CACHE_DIR, suffix=".tmp", delete=False) as file:
+        try:
+            json.dump(entry, file, separators=(",", ":"))
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    os.replace(file.name, path)
+    _evict_cache()
+
+def cached_get_json(url, headers, parse, ttl=EVENT_CACHE_TTL):
+    """
+    GETs a JSON url and returns parse(response), using the on-disk cache.
+
+    Only the parsed value is stored, so a fresh cache hit skips both the
+    download and parsing the full response. Stale entries are revalidated
+    with If-None-Match/If-Modified-Since; a 304 reuses the stored value.
+    """
+    path = _cache_path(url)
+    entry = _read_cache(path)
+    if entry is not None and time.time() - entry["fetched_at"] < ttl:
+        os.utime(path)  # Mark as recently used for eviction
+        logger.debug("Cache hit for %s", url)
+        return entry["value"]
+
+    request_headers = dict(headers)
+    if entry is not None:
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+    request = urllib.request.Request(url, headers=request_headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            value = parse(json.loads(response.read().decode()))
+            entry = {
+                "fetched_at": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "value": value,
+            }
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or entry is None:
+            raise
+        logger.debug("Not modified: %s", url)
+        entry["fetched_at"] = time.time()
+
+    try:
+        _write_cache(path, entry)
+    except OSError as e:
+        logger.warning("Could not write cache file %s: %s", path, e)
+    return entry["value"]
+
+def parse_events(events):
+    """Keeps the event and market fields the agent uses from a gamma-api events response."""
+    parsed_events = []
+    for event in events:
+        event_info = {
+            'volume': event.get('volume'),
+            'question': event.get('title'),
+            'slug': event.get('slug'),
+            'notes': event.get('description'),
+            'startDate': event.get('startDate'),
+            'endDate': event.get('endDate'),
+            'markets': []
+        }
+
+        for market in event.get('markets', []):
+            market_info = {
+                'question': market.get('question'),
+                'description': market.get('description'),
+                'conditionId': market.get('conditionId'),
+                'negativeMarketId': market.get('negRiskMarketID'),
+                'closedTime': market.get('closedTime'),
+                'clobTokenId': json.loads(market.get('clobTokenIds', [None]))[0]  # Assume first token ID is relevant
+            }
+            event_info['markets'].append(market_info)
+
+        parsed_events.append(event_info)
+    return parsed_events
 
 def fetch_and_parse_events(slug=None):
     """
@@ -119,6 +436,8 @@ def fetch_and_parse_events(slug=None):
     - endDate
     - markets (questions, ids, descriptions, conditionIds, clobTokenIds)
 
+    Responses are cached on disk per query (see cached_get_json).
+
     Returns:
         A list of dictionaries containing the parsed data.
     """
@@ -126,43 +445,13 @@ def fetch_and_parse_events(slug=None):
     if slug is not None:
         url += "&slug="+slug
     headers = {'User-Agent': 'Mozilla/5.0'}
-    request = urllib.request.Request(url, headers=headers)
     try:
-        with urllib.request.urlopen(request) as response:
-            data = response.read().decode()
-            events = json.loads(data)
-
-            parsed_events = []
-            for event in events:
-                event_info = {
-                    'volume': event.get('volume'),
-                    'question': event.get('title'),
-                    'slug': event.get('slug'),
-                    'notes': event.get('description'),
-                    'startDate': event.get('startDate'),
-                    'endDate': event.get('endDate'),
-                    'markets': []
-                }
-
-                for market in event.get('markets', []):
-                    market_info = {
-                        'question': market.get('question'),
-                        'description': market.get('description'),
-                        'conditionId': market.get('conditionId'),
-                        'negativeMarketId': market.get('negRiskMarketID'),
-                        'closedTime': market.get('closedTime'),
-                        'clobTokenId': json.loads(market.get('clobTokenIds', [None]))[0]  # Assume first token ID is relevant
-                    }
-                    event_info['markets'].append(market_info)
-
-                parsed_events.append(event_info)
-
-            return parsed_events
+        return cached_get_json(url, headers, parse_events)
     except urllib.error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason} (URL: {url})")
+        logger.error("HTTP Error: %s - %s (URL: %s)", e.code, e.reason, url)
         return []
     except Exception as e:
-        print(f"Error fetching data from {url}: {e}")
+        logger.error("Error fetching data from %s: %s", url, e)
         return []
 
 def calculate_hours(start_date, end_date):
@@ -184,12 +473,113 @@ def calculate_hours(start_date, end_date):
         hours_since_start = int((now - start_dt).total_seconds() / 3600)
         hours_until_end = int((end_dt - now).total_seconds() / 3600)
     except Exception as e:
-        print(f"Error parsing dates: {e}")
+        logger.error("Error parsing dates: %s", e)
         hours_since_start = 'N/A'
         hours_until_end = 'N/A'
 
     return hours_since_start, hours_until_end
 
+def fetch_order_books(token_ids, chunk_size=BOOKS_CHUNK_SIZE, workers=BOOKS_FETCH_WORKERS):
+    """
+    Fetches the order books for token_ids from the CLOB /books endpoint.
+
+    Token IDs are sent in chunks of at most chunk_size, fetched concurrently.
+    Returns (books keyed by asset_id, set of token IDs whose chunk failed);
+    a failed chunk does not fail the others.
+    """
+    url = CLOB_ENDPOINT + '/books'
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'Mozilla/5.0'}
+    chunks = [token_ids[i:i + chunk_size] for i in range(0, len(token_ids), chunk_size)]
+
+    def fetch(chunk):
+        data = json.dumps([{'token_id': token_id} for token_id in chunk]).encode('utf-8')
+        request = urllib.request.Request(url, data=data, headers=headers, method='POST')
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode())
+
+    books = {}
+    failed = set()
+    if not chunks:
+        return books, failed
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        futures = [(chunk, executor.submit(fetch, chunk)) for chunk in chunks]
+        for chunk, future in futures:
+            try:
+                for order_book in future.result():
+                    books[order_book.get("asset_id")] = order_book
+            except Exception as e:
+                logger.warning("Failed to fetch %d order books: %s", len(chunk), e)
+                failed.update(chunk)
+    return books, failed
+
+class BookSide:
+    """
+    One side of a CLOB order book, best price first, with cumulative size
+    and cost lists so fills are priced by binary search over the levels.
+    """
+    def __init__(self, levels, descending):
+        levels = sorted(((float(level['price']), float(level['size'])) for level in levels), reverse=descending)
+        levels = [(price, size) for price, size in levels if size > 0]
+        self.descending = descending
+        self.prices = [price for price, _ in levels]
+        # Ascending keys for bisecting by price limit
+        self.keys = [-price for price in self.prices] if descending else self.prices
+        self.cumulative_sizes = list(itertools.accumulate(size for _, size in levels))
+        self.cumulative_costs = list(itertools.accumulate(price * size for price, size in levels))
+
+    def best(self):
+        return self.prices[0] if self.prices else None
+
+    def _levels(self, limit):
+        """Number of levels priced at or better than limit."""
+        if limit is None:
+            return len(self.prices)
+        return bisect.bisect_right(self.keys, -limit if self.descending else limit)
+
+    def fill(self, amount, limit=None):
+        """(volume-weighted average price, filled size) for taking up to amount at prices no worse than limit."""
+        levels = self._levels(limit)
+        if amount <= 0 or not levels:
+            return None, 0.0
+        amount = min(amount, self.cumulative_sizes[levels - 1])
+        level = bisect.bisect_left(self.cumulative_sizes, amount)
+        size_before = self.cumulative_sizes[level - 1] if level else 0.0
+        cost_before = self.cumulative_costs[level - 1] if level else 0.0
+        return (cost_before + (amount - size_before) * self.prices[level]) / amount, amount
+
+    def fill_cost(self, cost, limit=None):
+        """(volume-weighted average price, size) for spending up to cost at prices no worse than limit."""
+        levels = self._levels(limit)
+        if cost <= 0 or not levels:
+            return None, 0.0
+        cost = min(cost, self.cumulative_costs[levels - 1])
+        level = bisect.bisect_left(self.cumulative_costs, cost)
+        size_before = self.cumulative_sizes[level - 1] if level else 0.0
+        cost_before = self.cumulative_costs[level - 1] if level else 0.0
+        size = size_before + (cost - cost_before) / self.prices[level]
+        return cost / size, size
+
+    def average_price(self, amount):
+        """
+        Volume-weighted price of taking all of amount, pricing any part
+        beyond the book at its worst level (as the oracle values holdings).
+        None if the side is empty.
+        """
+        if not self.prices:
+            return None
+        if amount <= 0:
+            return self.prices[0]
+        price, filled = self.fill(amount)
+        if filled == amount:
+            return price
+        return (price * filled + (amount - filled) * self.prices[-1]) / amount
+
+class OrderBook:
+    """Bid and ask depth of one market; buys take the asks and sells take the bids."""
+    def __init__(self, order_book):
+        self.bids = BookSide(order_book.get('bids', []), descending=True)
+        self.asks = BookSide(order_book.get('asks', []), descending=False)
+
 def format_prices(parsed_data):
     """
     Helper method to format the parsed data into a readable string.
@@ -200,8 +590,10 @@ def format_prices(parsed_data):
     Returns:
         A formatted string containing the parsed data.
         List of top 3 walls in [bid, ask] format
+        List of full-depth OrderBooks (None where unavailable), in the same order
     """
     walls = []
+    books = []
     all_token_ids = []
     token_ids = []
     for event in parsed_data:
@@ -209,35 +601,25 @@ def format_prices(parsed_data):
             all_token_ids += [[market["question"], market["clobTokenId"]]]
             if market["closedTime"] is None:
                 token_ids += [market["clobTokenId"]]
-    url = CLOB_ENDPOINT + '/books'
-    headers = {'Content-Type': 'application/json', 'User-Agent': 'Mozilla/5.0'}
-
-    # Prepare the data payload
-    params = [{'token_id': token_id} for token_id in token_ids]
-    data = json.dumps(params).encode('utf-8')
 
-    request = urllib.request.Request(url, data=data, headers=headers, method='POST')
-    idx = 1
-
-    with urllib.request.urlopen(request) as response:
-        response_data = response.read().decode()
-        order_books = json.loads(response_data)
-
-        # Format the order_books data into a readable string
-        formatted_output = []
-        for question, token_id in all_token_ids:
-            order_book = next((order for order in order_books if order.get("asset_id") == token_id), None)
-            s = f"{idx}. {question}"
-            idx+=1
-            if order_book is None:
-                formatted_output.append(f"{s} = Market closed")
-                walls += [[[],[]]]
-                continue
-            walls += [[order_book.get('bids', [])[-3:], order_book.get('asks', [])[-3:]]]
-            s += f" = {float(walls[-1][0][-1].get('price'))*100.0}%-{float(walls[-1][1][-1].get('price'))*100.0}%"
-            formatted_output.append(s)
-
-        return "\n".join(formatted_output), walls
+    order_books, failed = fetch_order_books(token_ids)
+
+    # Format the order_books data into a readable string
+    formatted_output = []
+    for idx, (question, token_id) in enumerate(all_token_ids, 1):
+        order_book = order_books.get(token_id)
+        s = f"{idx}. {question}"
+        if order_book is None:
+            formatted_output.append(f"{s} = Prices unavailable" if token_id in failed else f"{s} = Market closed")
+            walls += [[[],[]]]
+            books.append(None)
+            continue
+        walls += [[order_book.get('bids', [])[-3:], order_book.get('asks', [])[-3:]]]
+        books.append(OrderBook(order_book))
+        s += f" = {float(walls[-1][0][-1].get('price'))*100.0}%-{float(walls[-1][1][-1].get('price'))*100.0}%"
+        formatted_output.append(s)
+
+    return "\n".join(formatted_output), walls, books
 
 def format_events(parsed_data):
     """
@@ -281,7 +663,7 @@ def format_market(event, market):
     """
     hours_since_start, hours_until_end = calculate_hours(event['startDate'], event['endDate'])
     current_day = datetime.now().strftime("%A, %B %d, %Y")
-    print(market)
+    logger.debug("Market: %s", market)
 
     return (
         f"Event Question: {event['question']}\n"
@@ -296,29 +678,227 @@ def format_market(event, market):
         "\nYou are trying to solve the probability of this happening. It can be 0% to 100% probability of 'Yes'. Output format is:\nReasoning: free form reason for probability\nProbability: Y%.\n"
     )
 
-def main():
-    inp = env.list_messages()[-1]["content"]
-    if isinstance(inp, str):
+_completion_slots = threading.BoundedSemaphore(AGENT_COMPLETION_CONCURRENCY)
+
+def completion_chunks(prompts):
+    """
+    Yields the completion text as it is generated when the environment can
+    stream (env.completions(..., stream=True)), otherwise all at once.
+    """
+    stream = None
+    if AGENT_STREAM_COMPLETIONS and hasattr(env, "completions"):
         try:
-            inp = json_lib.loads(inp)
-        except:
-            pass
+            stream = env.completions(prompts, model=MODEL, stream=True)
+        except TypeError as e:
+            logger.warning("Streaming completions unavailable: %s", e)
+    if stream is None:
+        yield env.completion(prompts, model=MODEL)
+        return
+    try:
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        # Stop generating once the caller has what it needs
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+def completion_lines(prompts):
+    """
+    Yields each line of the completion as soon as it is complete, holding
+    one of AGENT_COMPLETION_CONCURRENCY slots until the caller stops reading.
+    """
+    with _completion_slots:
+        pending = ""
+        for chunk in completion_chunks(prompts):
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            yield from lines
+        if pending:
+            yield pending
+
+def complete(prompts):
+    """env.completion, limited to AGENT_COMPLETION_CONCURRENCY calls at once."""
+    return "\n".join(completion_lines(prompts))
+
+def event_fingerprint(data):
+    """The event and market text the predictions depend on, without volume or clock-dependent fields."""
+    return [
+        [event['question'], event['notes'], event['endDate'],
+         [[market['question'], market['description'], market['closedTime']] for market in event['markets']]]
+        for event in data
+    ]
+
+def wall_prices(walls):
+    """Best [bid, ask] of every market (None for a missing side), from format_prices walls."""
+    prices = []
+    for bids, asks in walls:
+        prices.append([float(bids[-1]['price']) if bids else None, float(asks[-1]['price']) if asks else None])
+    return prices
+
+def prices_moved(old, new, threshold=PREDICTION_CACHE_THRESHOLD):
+    """True if any bid/ask appeared, disappeared or moved by threshold or more."""
+    if len(old) != len(new):
+        return True
+    for old_pair, new_pair in zip(old, new):
+        for old_price, new_price in zip(old_pair, new_pair):
+            if (old_price is None) != (new_price is None):
+                return True
+            if old_price is not None and abs(old_price - new_price) >= threshold:
+                return True
+    return False
+
+def cached_completion_lines(prompts, fingerprint, prices, max_age=PREDICTION_CACHE_MAX_AGE, complete=None):
+    """
+    completion_lines(prompts), reusing the last completion for the same
+    fingerprint if its prompt was identical, or if it is younger than
+    max_age and no price moved materially (see prices_moved). The
+    fingerprint must cover everything in the prompt that should force a new
+    completion, other than prices and the clock.
+
+    A new completion is only cached if complete() (the caller's check that
+    it got everything it needed) is true once reading stops, whether the
+    stream ended or the caller stopped early. Without complete, only a
+    completion read to the end is cached.
+    """
+    path = _cache_path("completion " + json.dumps([MODEL, fingerprint], sort_keys=True))
+    prompt_hash = hashlib.sha256(json.dumps(prompts, sort_keys=True).encode("utf-8")).hexdigest()
+    entry = _read_cache(path)
+    # Entries written before completeness was checked may hold truncated completions
+    if entry is not None and entry.get("complete"):
+        if entry["prompt_hash"] == prompt_hash:
+            logger.info("Reusing completion for an identical prompt")
+            yield from entry["completion"].split("\n")
+            return
+        if time.time() - entry["created_at"] < max_age and not prices_moved(entry["prices"], prices):
+            logger.info("Reusing completion, prices have not moved")
+            yield from entry["completion"].split("\n")
+            return
+
+    lines = []
+
+    def store():
+        try:
+            _write_cache(path, {"prompt_hash": prompt_hash, "prices": prices, "created_at": time.time(), "completion": "\n".join(lines), "complete": True})
+        except OSError as e:
+            logger.warning("Could not write cache file %s: %s", path, e)
 
-    if not isinstance(inp, dict):
-        inp = {"url": inp}
+    try:
+        for line in completion_lines(prompts):
+            lines.append(line)
+            yield line
+    except GeneratorExit:
+        if complete is not None and complete():
+            store()
+        raise
+    if complete is None or complete():
+        store()
+
+def cached_complete(prompts, fingerprint, prices, max_age=PREDICTION_CACHE_MAX_AGE):
+    """The full text of cached_completion_lines."""
+    return "\n".join(cached_completion_lines(prompts, fingerprint, prices, max_age))
+
+def kelly_recommendation(combined_data, usdc_available, books=None, budget=None, fraction=KELLY_FRACTION, max_position=KELLY_MAX_POSITION, min_edge=KELLY_MIN_EDGE):
+    """
+    Picks one action from the predictions and order books without an LLM call.
+
+    BUY: YES shares when the predicted probability p beats the best ask by
+    min_edge, staking fraction * Kelly ((p - ask) / (1 - ask)) of
+    usdc_available, capped so the position stays within max_position of
+    usdc_available and the stake within budget (the USDC a batch run has
+    not committed yet, if given). SELL: `fraction` of a held position when the best bid
+    is above p by min_edge. Both walk the book (books by question, else the
+    entry's wall) only through levels that keep min_edge, so the size and
+    expected profit reflect slippage. The candidate with the largest
+    expected profit wins. Returns the action in the LLM's format
+    ('BUY <amount> "<question>"'), or None if nothing has enough edge.
+    """
+    bankroll = float(usdc_available)
+    best = None
+    for entry in combined_data:
+        book = (books or {}).get(entry['question'])
+        if book is None:
+            bids, asks = entry.get('wall') or ([], [])
+            book = OrderBook({'bids': bids, 'asks': asks})
+        probability = entry['probability']
+        holding = entry.get('holding') or {}
+        owned = float(holding.get('amount', 0) or 0)
+        candidates = []
+        ask = book.asks.best()
+        if ask is not None and 0 < ask < 1 and probability - ask >= min_edge:
+            stake = fraction * (probability - ask) / (1 - ask) * bankroll
+            stake = min(stake, max_position * bankroll - owned * ask)
+            if budget is not None:
+                stake = min(stake, budget)
+            price, size = book.asks.fill_cost(stake, limit=probability - min_edge)
+            if price is not None:
+                candidates.append(("BUY", int(size), probability - price))
+        bid = book.bids.best()
+        if bid is not None and owned > 0 and bid - probability >= min_edge:
+            price, size = book.bids.fill(int(owned * fraction) or int(owned), limit=probability + min_edge)
+            if price is not None:
+                candidates.append(("SELL", int(size), price - probability))
+        for action, amount, edge in candidates:
+            if amount > 0 and (best is None or amount * edge > best[0]):
+                best = (amount * edge, action, amount, entry['question'])
+    if best is None:
+        return None
+    _, action, amount, question = best
+    return f'{action} {amount} "{question}"'
+
+class Bankroll:
+    """
+    USDC that the markets of one batch run may still spend. The markets are
+    analyzed concurrently against the same usdc_available, so each BUY is
+    committed here and their costs together stay within it.
+    """
+    def __init__(self, usdc_available):
+        self.remaining = float(usdc_available)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _cost(book, amount):
+        # Shares the book has no asks for are counted at 1 USDC, the most a share can cost
+        price = book.asks.average_price(amount)
+        return amount * (price if price is not None else 1.0)
+
+    def commit_buy(self, book, amount):
+        """Commits buying amount shares from book, or as many as the remaining USDC covers. Returns the shares."""
+        with self.lock:
+            low, high = 0, amount
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self._cost(book, middle) <= self.remaining + 1e-9:
+                    low = middle
+                else:
+                    high = middle - 1
+            self.remaining -= self._cost(book, low)
+            return low
+
+def analyze_market(inp):
+    """
+    Predicts the outcomes of one market, asks for a recommended action and
+    sends it to the callback.
 
+    inp holds the market "url" and optionally "holdings", "usdc_available",
+    "pool_name" (or "pool_names", one callback each) and "callback_url". Returns the template context for the
+    market, or None if there is no market data. In batch mode inp also holds
+    the run's shared "bankroll", which caps any BUY at the USDC left.
+    """
+    slug = None
     if "https:" in inp["url"]:
         parsed_url = urllib.parse.urlparse(inp['url'])
         slug = parsed_url.path.split('/')[-1]
 
     data = fetch_and_parse_events(slug)
     if not data:
-        print("No market data available.")
-        return
+        logger.warning("No market data available for %s.", inp["url"])
+        return None
 
-    formatted_markets = format_markets(data)
-    formatted_event = format_events(data)
-    formatted_prices, walls = format_prices(data)
+    formatted_prices, walls, books = format_prices(data)
+    formatted_event, formatted_markets, formatted_prices, included = build_prompt_sections(data, formatted_prices, walls)
     question_prompt = formatted_event + formatted_markets + "\n\nCurrent market predictions:\n"+formatted_prices+"\n\nPredictions:\n"
     sys_prompt = """You are predicting an event. You will return the probabilities of each option being true.
 
@@ -347,47 +927,60 @@ Predictions:
 2. Sun will not rise tomorrow: Earth will not stop spinning = 0.0%
 """
 
-    print(sys_prompt)
-    print(question_prompt)
+    logger.debug("Prediction prompt: %s\n%s", sys_prompt, question_prompt)
     # Parse the predictions_llm_result to extract probabilities
     predictions = {}
     prompts = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": question_prompt}]
-    predictions_llm_result = env.completion(prompts, model=MODEL)
-
-    lines = predictions_llm_result.splitlines()
-    idx = 0
+    prices = wall_prices(walls)
+    markets = [market for event in data for market in event['markets']]
+    expected = sorted(included)
+    lines = []
     predictions = []
-    for line in lines:
-        if line.strip():
-            idx += 1
-            market = data[0]['markets'][idx - 1]
-            match = re.match(r'(.*?):\s*(.*?)\s*=\s*([\d\.]+)%', line)
-
-            if match:
-                question = market['question']
-                reasoning = match.group(2).strip()
-                probability = float(match.group(3))/100.0
-                predictions.append([question,reasoning,probability])
-            else:
-                print(f"Could not parse line: {line}")
-
-    print("From prompts", prompts)
-    print("____")
-    print(predictions_llm_result)
-    print("PREDICTIONS")
-    print(predictions)
+    seen = set()
+    # Parse each line as it streams in and stop reading once every market has a probability
+    stream = cached_completion_lines(prompts, ["predictions", event_fingerprint(data), expected], prices, complete=lambda: len(seen) == len(expected))
+    for line in stream:
+        lines.append(line)
+        if not line.strip():
+            continue
+        match = re.match(r'(.*?):\s*(.*?)\s*=\s*([\d\.]+)%', line)
+        if not match:
+            # Preambles and other chatter do not count towards the expected markets
+            logger.warning("Could not parse line: %s", line)
+            continue
+        # Lines are numbered with the market numbers from the prompt; fall back to the next market without one
+        number = re.match(r'\s*(\d+)\.', match.group(1))
+        if number and int(number.group(1)) in included:
+            position = int(number.group(1))
+        else:
+            position = next((idx for idx in expected if idx not in seen), expected[-1])
+        seen.add(position)
+        question = markets[position - 1]['question']
+        reasoning = match.group(2).strip()
+        probability = float(match.group(3))/100.0
+        predictions.append([question,reasoning,probability])
+        logger.debug("Prediction %d/%d: %s = %s", len(seen), len(expected), question, probability)
+        if len(seen) == len(expected):
+            break
+    stream.close()
+    predictions_llm_result = "\n".join(lines)
+
+    logger.debug("Prediction completion: %s", predictions_llm_result)
+    logger.info("Parsed %d predictions", len(predictions))
     environment_id = globals()['env'].env_vars.get("environmentId", globals()['env'].env_vars.get("environment_id", "")) # this should be set by the app runner
     agent_id = "smartpool.near/prediction-market-assistant/0.0.7"
 
-    print("WALLS", len(walls), walls)
+    logger.info("Walls: %s", summarize(walls))
     # Build a dictionary to map walls to questions
     walls_dict = {}
+    books_dict = {}
     idx = 0
     for event in data:
         for market in event['markets']:
             question = market['question']
             wall = walls[idx] if idx < len(walls) else None
             walls_dict[question] = wall
+            books_dict[question] = books[idx] if idx < len(books) else None
             idx += 1
     # Create a mapping for holdings based on question
     holdings = inp.get('holdings', {})
@@ -400,8 +993,8 @@ Predictions:
         # Get holding based on question
         holding = holdings.get(question, None)
 
-        # Get wall based on index (assuming walls list matches the order)
-        wall = walls[idx] if idx < len(walls) else None
+        # Get wall based on question (markets left out of the prompt have no prediction)
+        wall = walls_dict.get(question)
 
         combined_data.append({
             'question': question,
@@ -417,26 +1010,30 @@ Predictions:
         holding = data_entry.get('holding')
         wall = data_entry.get('wall')
         if holding and wall:
-            print("COST BASIS", data_entry)
+            logger.debug("Cost basis: %s", data_entry)
             try:
-                current_price = float(wall[0][-1]["price"])
                 cost_basis = float(holding.get('cost_basis', 0))
                 amount = float(holding.get('amount', 0))
+                book = books_dict.get(data_entry['question'])
+                # What selling the whole position into the bids would fetch, not just the top bid
+                current_price = book.bids.average_price(amount) if book else None
+                if current_price is None:
+                    current_price = float(wall[0][-1]["price"])
                 current_value = current_price * amount
-                profit = (current_price - cost_basis) * amount
+                profit = current_value - cost_basis * amount
                 data_entry['profit'] = profit
                 data_entry['current_value'] = current_value
                 data_entry['cost_basis'] = cost_basis
                 data_entry['current_price'] = current_price
                 data_entry['amount_owned'] = amount
             except (IndexError, KeyError, ValueError, TypeError) as e:
-                print(f"Error calculating profit for question '{data_entry.get('question', 'N/A')}': {e}")
+                logger.error("Error calculating profit for question '%s': %s", data_entry.get('question', 'N/A'), e)
                 data_entry['profit'] = None
         else:
             data_entry['profit'] = None
 
-    print("COMBINED DATA")
-    print(json.dumps(combined_data, indent=4))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Combined data: %s", json.dumps(combined_data, indent=4))
     recommended_sys_prompt = """You are deciding what action to take as a prediction fund manager. Your goal is to maximize profit in usdc while keeping good bets.
 
 You must keep the output format as either:
@@ -495,20 +1092,113 @@ SELL 50 "Flash" YES"""
             current_holdings += f"  profit: ${data_entry['profit']}\n"
     recommended_user_prompt = f"Prediction Market:\n{formatted_event}{formatted_markets}\n\nCurrent holdings:\n{current_holdings}\n\nMarket costs:\n{formatted_prices}\n\nEstimated probabilities:\n{json.dumps(predictions,indent=2)}\n\nRecommended action:\n"
 
-    print("CALLING")
-    print(recommended_sys_prompt)
-    print(recommended_user_prompt)
+    if AGENT_LLM_RECOMMENDATION:
+        logger.debug("Recommendation prompt: %s\n%s", recommended_sys_prompt, recommended_user_prompt)
 
-    prompts = [{"role": "system", "content": recommended_sys_prompt}, {"role": "user", "content": recommended_user_prompt}]
-    recommended_action = env.completion(prompts, model=MODEL)
+        prompts = [{"role": "system", "content": recommended_sys_prompt}, {"role": "user", "content": recommended_user_prompt}]
+        recommended_action = cached_complete(
+            prompts,
+            ["recommendation", event_fingerprint(data), predictions, inp.get('holdings', {}), usdc_holdings],
+            prices,
+        )
+    else:
+        bankroll = inp.get("bankroll")
+        recommended_action = kelly_recommendation(combined_data, usdc_holdings, books_dict, budget=bankroll.remaining if bankroll else None)
+        if recommended_action is None:
+            logger.info("No trade has enough edge for %s", inp["url"])
+            recommended_action = "HOLD"
 
     parsed = parse_recommended_action(recommended_action)
-    print("Recommended:", recommended_action, parsed)
-    render_template({'sys_prompt': sys_prompt, 'prompt': question_prompt, 'predictions':json.dumps(predictions, indent=4),'environment_id':environment_id, 'agent_id':agent_id, "recommended_action": recommended_action, "recommended_sys_prompt": recommended_sys_prompt, "recommended_user_prompt": recommended_user_prompt})
+    if inp.get("bankroll") is not None and parsed is not None and parsed["action"].upper() == "BUY":
+        # Another market of the batch may have committed the USDC since this one was sized
+        entry = next((entry for entry in combined_data if entry['question'] == parsed['question']), {})
+        bids, asks = entry.get('wall') or ([], [])
+        book = books_dict.get(parsed['question']) or OrderBook({'bids': bids, 'asks': asks})
+        amount = inp["bankroll"].commit_buy(book, parsed["amount"])
+        if amount < parsed["amount"]:
+            logger.info("Batch bankroll covers %d of %d shares for %s", amount, parsed["amount"], inp["url"])
+            parsed["amount"] = amount
+            recommended_action = f'BUY {amount} "{parsed["question"]}"' if amount else "HOLD"
+    logger.info("Recommended: %s %s", summarize(recommended_action), parsed)
+
+    if recommended_action == "HOLD":
+        pass
+    elif parsed is None:
+        logger.warning("Could not parse the recommended action for %s", inp["url"])
+    else:
+        # The oracle runs the agent once for all pools with the same market and holdings
+        for pool_name in inp.get("pool_names") or [inp.get("pool_name", None)]:
+            send_callback(pool_name, inp.get("callback_url", None), inp["url"], parsed["action"].lower(), ["yes", parsed["question"]], parsed["amount"])
+    return {'sys_prompt': sys_prompt, 'prompt': question_prompt, 'predictions':json.dumps(predictions, indent=4),'environment_id':environment_id, 'agent_id':agent_id, "recommended_action": recommended_action, "recommended_sys_prompt": recommended_sys_prompt, "recommended_user_prompt": recommended_user_prompt}
+
+def analyze_markets(inp):
+    """
+    Batch mode: analyzes every entry of inp["markets"] concurrently.
+
+    Each entry is a market URL or a dict with "url" and optionally
+    "holdings" and "usdc_available"; "pool_name", "pool_names",
+    "callback_url" and "usdc_available" default to the top-level values. One callback is sent
+    per market. Markets using the top-level usdc_available share it, so
+    their BUYs together never cost more than it. Returns the template
+    contexts of the markets that succeeded.
+    """
+    shared = {key: inp[key] for key in ("pool_name", "pool_names", "callback_url", "usdc_available") if key in inp}
+    shared["bankroll"] = Bankroll(inp.get("usdc_available", 100))
+    markets = []
+    for market in inp["markets"]:
+        market = market if isinstance(market, dict) else {"url": market}
+        if "usdc_available" in market:
+            # Its own USDC, sized on its own
+            market = {**market, "bankroll": None}
+        markets.append({**shared, **market})
+
+    def analyze(market):
+        try:
+            return analyze_market(market)
+        except Exception as e:
+            logger.error("Failed to analyze %s: %s", market.get("url"), e)
+            return None
+
+    if not markets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(AGENT_BATCH_WORKERS, len(markets))) as executor:
+        results = list(executor.map(analyze, markets))
+    logger.info("Analyzed %d of %d markets", sum(result is not None for result in results), len(markets))
+    return [result for result in results if result is not None]
+
+def combine_contexts(contexts):
+    """Template context showing several markets, one section per market in each field."""
+    if len(contexts) == 1:
+        return contexts[0]
+    combined = {}
+    for key in contexts[0]:
+        if key in ("environment_id", "agent_id"):
+            combined[key] = contexts[0][key]
+        else:
+            combined[key] = "\n\n".join(f"--- Market {i} ---\n{context[key]}" for i, context in enumerate(contexts, 1))
+    return combined
+
+def main():
+    inp = env.list_messages()[-1]["content"]
+    if isinstance(inp, str):
+        try:
+            inp = json.loads(inp)
+        except ValueError:
+            pass
+
+    if not isinstance(inp, dict):
+        inp = {"url": inp}
+
+    if "markets" in inp:
+        contexts = analyze_markets(inp)
+    else:
+        context = analyze_market(inp)
+        contexts = [context] if context is not None else []
 
-    send_callback(inp.get("pool_name", None), inp.get("callback_url", None), inp["url"], parsed["action"].lower(), ["yes", parsed["question"]], parsed["amount"])
+    if contexts:
+        render_template(combine_contexts(contexts))
     env.mark_done()
 
 if __name__ == "__main__":
-    print("calling main")
+    logger.info("calling main")
     main()
@@ -0,0 +1,112 @@
+import anyTest from 'ava';
+import sinon from 'sinon';
+import esmock from 'esmock';
+import PoolService from '../services/poolService.js';
+
+const test = anyTest.serial;
+let handler, tx, transaction;
+
+// Minimal Next.js response: records the status and JSON body
+function mockResponse() {
+  const res = {};
+  res.status = sinon.stub().returns(res);
+  res.json = sinon.stub().returns(res);
+  return res;
+}
+
+test.beforeEach(async () => {
+  tx = {
+    $queryRaw: sinon.stub(),
+    pool: { update: sinon.stub() },
+    action: { create: sinon.stub() },
+  };
+  transaction = sinon.stub().callsFake(async (fn) => fn(tx));
+  class PrismaClient {
+    constructor() {
+      this.$transaction = transaction;
+    }
+  }
+  ({ default: handler } = await esmock('../pages/api/apply_pool_changes.js', {}, {
+    '@prisma/client': { PrismaClient },
+  }));
+});
+
+test.afterEach.always(() => {
+  esmock.purge(handler);
+});
+
+test('applyHoldingChanges should add to existing assets and create new ones', (t) => {
+  const holdings = {
+    USDC: { amount: '100', name: 'USDC' },
+    'Will it rain?': { amount: '10', name: 'Will it rain?', cost_basis: '0.4' },
+  };
+  const result = PoolService.applyHoldingChanges(holdings, [
+    { assetName: 'USDC', amount: '-25.5' },
+    { assetName: 'Will it rain?', amount: '5', costBasis: '0.5' },
+    { assetName: 'Will it snow?', amount: '20', costBasis: '0.3' },
+  ]);
+  t.is(result.USDC.amount, '74.5');
+  t.deepEqual(result['Will it rain?'], { amount: '15', name: 'Will it rain?', cost_basis: '0.4' });
+  t.deepEqual(result['Will it snow?'], { amount: '20', name: 'Will it snow?', cost_basis: '0.3' });
+});
+
+test('POST /api/apply_pool_changes should return 400 for missing fields', async (t) => {
+  const res = mockResponse();
+  await handler({ method: 'POST', body: { poolName: 'pool', changes: [] } }, res);
+  t.true(res.status.calledOnceWithExactly(400));
+  t.false(transaction.called);
+});
+
+test('POST /api/apply_pool_changes should return 400 for an incomplete change', async (t) => {
+  const res = mockResponse();
+  const body = { poolName: 'pool', changes: [{ assetName: 'USDC' }], action: { action: 'BUY', by: 'oracle' } };
+  await handler({ method: 'POST', body }, res);
+  t.true(res.status.calledOnceWithExactly(400));
+  t.false(transaction.called);
+});
+
+test('POST /api/apply_pool_changes should return 404 for an unknown pool', async (t) => {
+  tx.$queryRaw.resolves([]);
+  const res = mockResponse();
+  const body = { poolName: 'missing', changes: [{ assetName: 'USDC', amount: '1' }], action: { action: 'BUY', by: 'oracle' } };
+  await handler({ method: 'POST', body }, res);
+  t.true(res.status.calledOnceWithExactly(404));
+  t.false(tx.pool.update.called);
+  t.false(tx.action.create.called);
+});
+
+test('POST /api/apply_pool_changes should apply every change and the action in one transaction', async (t) => {
+  tx.$queryRaw.resolves([{ holdings: { USDC: { amount: '100', name: 'USDC' } } }]);
+  tx.pool.update.callsFake(async ({ data }) => ({ name: 'pool', holdings: data.holdings }));
+  tx.action.create.callsFake(async ({ data }) => ({ id: 7, ...data }));
+  const res = mockResponse();
+  const body = {
+    poolName: 'pool',
+    changes: [
+      { assetName: 'USDC', amount: '-40' },
+      { assetName: 'Will it rain?', amount: '80', costBasis: '0.5' },
+    ],
+    action: { action: 'BUY', by: 'oracle', details: { market: 'Will it rain?' } },
+  };
+  await handler({ method: 'POST', body }, res);
+
+  t.true(transaction.calledOnce);
+  t.true(tx.$queryRaw.calledOnce);
+  t.regex(tx.$queryRaw.firstCall.args[0].join('?'), /FOR UPDATE/);
+  t.is(tx.$queryRaw.firstCall.args[1], 'pool');
+  t.true(tx.$queryRaw.calledBefore(tx.pool.update));
+  t.true(res.status.calledOnceWithExactly(200));
+  t.deepEqual(tx.pool.update.firstCall.args[0], {
+    where: { name: 'pool' },
+    data: {
+      holdings: {
+        USDC: { amount: '60', name: 'USDC' },
+        'Will it rain?': { amount: '80', name: 'Will it rain?', cost_basis: '0.5' },
+      },
+    },
+  });
+  t.deepEqual(tx.action.create.firstCall.args[0], {
+    data: { action: 'BUY', by: 'oracle', details: { market: 'Will it rain?' }, poolName: 'pool' },
+  });
+  t.is(res.json.firstCall.args[0].action.id, 7);
+});
@@ -1,7 +1,7 @@
 import test from 'ava';
 import sinon from 'sinon';
 import { PrismaClient } from '@prisma/client';
-import { createJob, getPendingJobs, updateJobStatus } from '../services/jobService.js';
+import { createJob, getPendingJobs, updateJobStatus, waitForPendingJobs } from '../services/jobService.js';
 
 test.beforeEach((t) => {
   t.context.prisma = new PrismaClient();
@@ -66,6 +66,46 @@ test('getPendingJobs should return all pending jobs', async (t) => {
   t.deepEqual(result, pendingJobs);
 });
 
+test('waitForPendingJobs should return immediately when a newer job is pending', async (t) => {
+  const { prisma } = t.context;
+  const pendingJobs = [
+    { id: 4, action: 'buy', status: 'pending' },
+    { id: 7, action: 'sell', status: 'pending' },
+  ];
+
+  prisma.job.findMany.resolves(pendingJobs);
+
+  const result = await waitForPendingJobs(5, 10000, prisma);
+
+  t.true(prisma.job.findMany.calledOnce);
+  t.deepEqual(result, pendingJobs);
+});
+
+test('waitForPendingJobs should recheck until a newer job is pending', async (t) => {
+  const { prisma } = t.context;
+  const oldJobs = [{ id: 4, action: 'buy', status: 'pending' }];
+  const newJobs = [...oldJobs, { id: 5, action: 'sell', status: 'pending' }];
+
+  prisma.job.findMany.onFirstCall().resolves(oldJobs);
+  prisma.job.findMany.onSecondCall().resolves(newJobs);
+
+  const result = await waitForPendingJobs(4, 10000, prisma, 10);
+
+  t.true(prisma.job.findMany.calledTwice);
+  t.deepEqual(result, newJobs);
+});
+
+test('waitForPendingJobs should return pending jobs when the wait times out', async (t) => {
+  const { prisma } = t.context;
+  const oldJobs = [{ id: 4, action: 'buy', status: 'pending' }];
+
+  prisma.job.findMany.resolves(oldJobs);
+
+  const result = await waitForPendingJobs(4, 30, prisma, 10);
+
+  t.deepEqual(result, oldJobs);
+});
+
 test('updateJobStatus should update the job status and details', async (t) => {
   const { prisma } = t.context;
   const jobId = 1;
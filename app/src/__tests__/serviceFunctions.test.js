@@ -2,6 +2,7 @@ import test from 'ava';
 import sinon from 'sinon';
 import { handleBuy, handleSell } from '../services/nearAiService.js';
 import { handleDeposit, handleWithdraw } from '../services/smartContractService.js';
+import { fetchOrderBooks, formatPrices, parsedTokenIds } from '../services/polyService.js';
 
 import esmock from 'esmock';
 let createJob;
@@ -131,3 +132,35 @@ test('handleWithdraw should create a WITHDRAW job and return job info', async (t
   t.deepEqual(result, { message: 'Withdraw job added to queue', jobId: createdJob.id });
 });
 
+
+test('formatPrices should add order book depth for open markets', (t) => {
+  const parsedEvents = [{
+    markets: [
+      { question: 'Open', bestBid: '0.41', bestAsk: '0.45', clobTokenId: 'yes-1', closedTime: null },
+      { question: 'Closed', bestBid: '0.1', bestAsk: '0.2', clobTokenId: 'yes-2', closedTime: '2024-01-01' },
+    ],
+  }];
+  const bids = [{ price: '0.40', size: '500' }, { price: '0.41', size: '100' }];
+  const asks = [{ price: '0.46', size: '300' }, { price: '0.45', size: '50' }];
+
+  t.deepEqual(parsedTokenIds(parsedEvents), ['yes-1']);
+  t.deepEqual(formatPrices(parsedEvents, { 'yes-1': { asset_id: 'yes-1', bids, asks } }), {
+    Open: { bid: '0.410', ask: '0.450', bids, asks },
+    Closed: { bid: '0.100', ask: '0.200' },
+  });
+});
+
+test.serial('fetchOrderBooks should request the books in chunks', async (t) => {
+  const tokenIds = Array.from({ length: 45 }, (_, i) => `token${i}`);
+  const fetchStub = sinon.stub(globalThis, 'fetch').callsFake(async (url, options) => ({
+    json: async () => JSON.parse(options.body).map(({ token_id }) => ({ asset_id: token_id, bids: [], asks: [] })),
+  }));
+  try {
+    const books = await fetchOrderBooks(tokenIds);
+    t.is(fetchStub.callCount, 3);
+    t.deepEqual(fetchStub.getCalls().map((call) => JSON.parse(call.args[1].body).length), [20, 20, 5]);
+    t.deepEqual(Object.keys(books).sort(), [...tokenIds].sort());
+  } finally {
+    fetchStub.restore();
+  }
+});
@@ -1,7 +1,7 @@
 const { PrismaClient } = require('@prisma/client');
 const prisma = new PrismaClient();
 
-import Decimal from 'decimal.js';
+import PoolService from '@/services/poolService';
 
 export default async function handler(req, res) {
   if (req.method === 'POST') {
@@ -22,15 +22,7 @@ export default async function handler(req, res) {
       }
 
       // Parse and update holdings
-      const holdings = pool.holdings || {};
-      const currentAsset = holdings[assetName] || { amount: Decimal(0), name: assetName, cost_basis: costBasis };
-      const newAmount = (Decimal(currentAsset.amount || 0).plus(Decimal(amount))).toString();
-      // TODO: update cost basis on existing asset
-
-      holdings[assetName] = {
-        ...currentAsset,
-        amount: newAmount
-      };
+      const holdings = PoolService.applyHoldingChanges(pool.holdings || {}, [{ assetName, amount, costBasis }]);
 
       // Update the pool with new holdings
       const updatedPool = await prisma.pool.update({
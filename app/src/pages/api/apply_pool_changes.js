@@ -0,0 +1,61 @@
+import { PrismaClient } from '@prisma/client';
+import PoolService from '../../services/poolService.js';
+
+const prisma = new PrismaClient();
+
+// Applies several holding changes and records one action in a single transaction,
+// so a trade's books are either fully updated or not at all. The pool row is locked
+// until the transaction commits, so concurrent trades on one pool cannot lose an update.
+export default async function handler(req, res) {
+  if (req.method === 'POST') {
+    const { poolName, changes, action } = req.body;
+
+    if (!poolName || !Array.isArray(changes) || !action || !action.action || !action.by) {
+      return res.status(400).json({ error: 'Missing required fields: poolName, changes, or action' });
+    }
+    if (changes.some((change) => !change.assetName || change.amount == null)) {
+      return res.status(400).json({ error: 'Each change needs an assetName and amount' });
+    }
+
+    try {
+      const result = await prisma.$transaction(async (tx) => {
+        // Holdings are one JSON column, so they are read under a row lock rather than incremented
+        const [pool] = await tx.$queryRaw`SELECT "holdings" FROM "Pool" WHERE "name" = ${poolName} FOR UPDATE`;
+
+        if (!pool) {
+          return null;
+        }
+
+        const holdings = PoolService.applyHoldingChanges(pool.holdings || {}, changes);
+
+        const updatedPool = await tx.pool.update({
+          where: { name: poolName },
+          data: { holdings },
+        });
+
+        const newAction = await tx.action.create({
+          data: {
+            action: action.action,
+            by: action.by,
+            details: action.details || {},
+            poolName,
+          },
+        });
+
+        return { pool: updatedPool, action: newAction };
+      });
+
+      if (!result) {
+        return res.status(404).json({ error: 'Pool not found' });
+      }
+
+      res.status(200).json(result);
+    } catch (error) {
+      console.error('Error applying pool changes:', error);
+      res.status(500).json({ error: 'Internal Server Error' });
+    }
+
+  } else {
+    res.status(405).json({ error: 'Method not allowed' });
+  }
+}
@@ -1,10 +1,17 @@
-import { getPendingJobs, updateJobStatus } from '@/services/jobService';
+import { getPendingJobs, updateJobStatus, waitForPendingJobs } from '@/services/jobService';
+
+// Upper bound on how long a GET /api/jobs?wait=... request is held open
+const MAX_WAIT_SECONDS = 60;
 
 export default async function jobsHandler(req, res) {
   if (req.method === 'GET') {
-    // Fetch pending jobs for the job processor
+    // Fetch pending jobs for the job processor. With ?wait=<seconds>&after=<jobId>
+    // the request is held open until a job newer than `after` is pending.
+    const wait = Math.min(Number(req.query.wait) || 0, MAX_WAIT_SECONDS);
+    const after = Number(req.query.after) || 0;
+
     try {
-      const jobs = await getPendingJobs();
+      const jobs = wait > 0 ? await waitForPendingJobs(after, wait * 1000) : await getPendingJobs();
       res.status(200).json(jobs);
     } catch (error) {
       console.error('Error fetching jobs:', error);
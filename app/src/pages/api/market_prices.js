@@ -1,5 +1,5 @@
 import Decimal from "decimal.js";
-import { fetchAndParseEvents, formatPrices } from '@/services/polyService';
+import { fetchAndParseEvents, fetchOrderBooks, formatPrices, parsedTokenIds } from '@/services/polyService';
 
 export default async function handler(req, res) {
   // Get event_name from query parameters
@@ -14,7 +14,9 @@ export default async function handler(req, res) {
   // Fetch data and process it
   try {
     const parsedEvents = await fetchAndParseEvents(event_name);
-    const formattedPrices = formatPrices(parsedEvents);
+    // Order book depth lets the oracle price fills larger than the top of the book
+    const orderBooks = await fetchOrderBooks(parsedTokenIds(parsedEvents));
+    const formattedPrices = formatPrices(parsedEvents, orderBooks);
     res.status(200).json(formattedPrices);
   } catch (error) {
     console.error(error);
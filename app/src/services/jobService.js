@@ -1,13 +1,19 @@
+import { EventEmitter } from 'events';
 import { PrismaClient } from '@prisma/client';
 
 const prisma = new PrismaClient();
 
+// Wakes long-polling job fetchers in this process as soon as a job is created
+export const jobEvents = new EventEmitter();
+jobEvents.setMaxListeners(0);
+
 export async function createJob(action, details, poolName, prismaClient = prisma) {
   const job = await prismaClient.job.create({data: {
     action: action,
     details: details,
     poolName: poolName
   }});
+  jobEvents.emit('created', job);
   return job;
 }
 
@@ -18,6 +24,30 @@ export async function getPendingJobs(prismaClient = prisma) {
   return jobs;
 }
 
+// Long poll: resolves with all pending jobs once one newer than `afterId` exists,
+// or after `waitMs` with whatever is pending. The database is re-checked every
+// `recheckMs` in case the job was created by another process.
+export async function waitForPendingJobs(afterId, waitMs, prismaClient = prisma, recheckMs = 1000) {
+  const deadline = Date.now() + waitMs;
+  while (true) {
+    const jobs = await getPendingJobs(prismaClient);
+    const remaining = deadline - Date.now();
+    if (remaining <= 0 || jobs.some((job) => job.id > afterId)) {
+      return jobs;
+    }
+
+    await new Promise((resolve) => {
+      const timer = setTimeout(done, Math.min(remaining, recheckMs));
+      function done() {
+        clearTimeout(timer);
+        jobEvents.off('created', done);
+        resolve();
+      }
+      jobEvents.on('created', done);
+    });
+  }
+}
+
 export async function updateJobStatus(jobId, status, details = null, prismaClient=prisma) {
   const job = await prismaClient.job.update({
     where: { id: jobId },
@@ -36,6 +36,7 @@ export async function fetchAndParseEvents(slug) {
           question: market.question,
           description: market.description,
           conditionId: market.conditionId,
+          clobTokenId: JSON.parse(market.clobTokenIds || '[]')[0],
           negativeMarketId: market.negRiskMarketID,
           closedTime: market.closedTime,
           bestBid: market.bestBid,
@@ -57,8 +58,42 @@ export async function fetchAndParseEvents(slug) {
   }
 }
 
-export function formatPrices(parsedData) {
-  const options = {}; // Output data in the format { key: { bid: bid, ask: ask } }
+// Most token ids sent in one /books request
+const BOOKS_CHUNK_SIZE = 20;
+
+// Fetches the CLOB order books of the given YES token ids, keyed by token id.
+// Ids are sent in chunks fetched concurrently; a failed chunk does not fail the others.
+export async function fetchOrderBooks(tokenIds) {
+  const books = {};
+  const chunks = [];
+  for (let i = 0; i < tokenIds.length; i += BOOKS_CHUNK_SIZE) {
+    chunks.push(tokenIds.slice(i, i + BOOKS_CHUNK_SIZE));
+  }
+  await Promise.all(chunks.map(async (chunk) => {
+    try {
+      const response = await fetch('https://clob.polymarket.com/books', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'User-Agent': 'Mozilla/5.0' },
+        body: JSON.stringify(chunk.map((tokenId) => ({ token_id: tokenId }))),
+      });
+      for (const book of await response.json()) {
+        books[book.asset_id] = book;
+      }
+    } catch (error) {
+      console.error(`Error fetching ${chunk.length} order books:`, error);
+    }
+  }));
+  return books;
+}
+
+export function parsedTokenIds(parsedData) {
+  return parsedData.flatMap((event) => event.markets.filter((market) => !market.closedTime && market.clobTokenId).map((market) => market.clobTokenId));
+}
+
+export function formatPrices(parsedData, orderBooks = {}) {
+  // Output data in the format { key: { bid: bid, ask: ask, bids: [...], asks: [...] } }
+  // bids/asks are the order book levels ({ price, size }), present when the book was fetched
+  const options = {};
 
   for (const event of parsedData) {
     for (const market of event.markets) {
@@ -70,6 +105,11 @@ export function formatPrices(parsedData) {
       let askPrice = market.bestAsk ? Decimal(market.bestAsk).toFixed(3) : null;
 
       options[question] = { bid: bidPrice, ask: askPrice };
+      const book = orderBooks[market.clobTokenId];
+      if (book) {
+        options[question].bids = book.bids || [];
+        options[question].asks = book.asks || [];
+      }
     }
   }
 
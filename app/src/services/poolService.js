@@ -1,4 +1,5 @@
-const { PrismaClient } = require('@prisma/client');
+import { PrismaClient } from '@prisma/client';
+import Decimal from 'decimal.js';
 
 const prisma = new PrismaClient();
 
@@ -30,6 +31,22 @@ class PoolService {
     return pool;
   }
 
+  // Adds each { assetName, amount, costBasis } change to the holdings.
+  // New assets take the change's cost basis.
+  static applyHoldingChanges(holdings, changes) {
+    for (const { assetName, amount, costBasis } of changes) {
+      const currentAsset = holdings[assetName] || { amount: Decimal(0), name: assetName, cost_basis: costBasis };
+      const newAmount = (Decimal(currentAsset.amount || 0).plus(Decimal(amount))).toString();
+      // TODO: update cost basis on existing asset
+
+      holdings[assetName] = {
+        ...currentAsset,
+        amount: newAmount
+      };
+    }
+    return holdings;
+  }
+
   static getEstimatedValue(holdings, market_prices) {
     const NEAR_CONVERSION_USD = 5.0; // TODO: Ideally, fetch this dynamically if time permits.
     let totalNEAR = holdings.NEAR.amount;
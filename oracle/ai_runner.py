@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+import time
+
+import metrics
+from log import logger, summarize
+
+# Maximum number of NEAR AI agent runs in flight at once
+NEAR_AI_CONCURRENCY = int(os.getenv("NEAR_AI_CONCURRENCY", "4"))
+# Maximum number of NEAR AI agent runs started per second (0 for no limit)
+NEAR_AI_RATE = float(os.getenv("NEAR_AI_RATE", "1"))
+# Seconds a run waits for identical requests from other pools before it starts
+NEAR_AI_COALESCE_WINDOW = float(os.getenv("NEAR_AI_COALESCE_WINDOW", "2"))
+
+class RateLimiter:
+    """Spaces out callers so no more than `rate` of them pass per second."""
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        start = max(now, self.next_at)
+        # Reserve the slot before sleeping, so concurrent callers queue up behind it
+        self.next_at = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+class NearAiRunner:
+    """
+    Starts NEAR AI agent runs in the background.
+
+    Requests for the same market with the same USDC and holdings that
+    arrive within `window` seconds of each other share one run, made for
+    all of their pools at once (call(pool_names, market_url, usdc_available,
+    holdings)). At most `concurrency` runs are in flight, and runs start no
+    faster than `rate` per second.
+    """
+    def __init__(self, call, concurrency=NEAR_AI_CONCURRENCY, rate=NEAR_AI_RATE, window=NEAR_AI_COALESCE_WINDOW):
+        self.call = call
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate)
+        self.window = window
+        self.pending = {}
+        self.tasks = set()
+
+    def submit(self, pool_name, market_url, usdc_available, holdings):
+        """Schedules a run for the pool, joining a pending identical one. Returns the run's task."""
+        key = (market_url, json.dumps([usdc_available, holdings], sort_keys=True, default=str))
+        pending = self.pending.get(key)
+        if pending is not None:
+            pool_names, task = pending
+            if pool_name not in pool_names:
+                pool_names.append(pool_name)
+            logger.debug("Coalesced NEAR AI run for {} on {} with {}", pool_name, market_url, pool_names[0])
+            return task
+
+        pool_names = [pool_name]
+        task = asyncio.create_task(self._run(key, pool_names, market_url, usdc_available, holdings))
+        self.pending[key] = (pool_names, task)
+        # The event loop only keeps weak references to tasks
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run(self, key, pool_names, market_url, usdc_available, holdings):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            del self.pending[key]
+        async with self.semaphore:
+            await self.limiter.wait()
+            try:
+                with metrics.stage_seconds.time(stage="near_ai run"):
+                    response = await self.call(pool_names, market_url, usdc_available, holdings)
+            except Exception as e:
+                logger.error("NEAR AI run for {} on {} failed: {}", pool_names, market_url, e)
+                metrics.stage_failures.inc(stage="near_ai run")
+                return None
+        logger.info("NEAR AI run for {} on {}: {}", pool_names, market_url, summarize(response))
+        return response
+
+    async def join(self):
+        """Waits until every submitted run has finished."""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
@@ -0,0 +1,109 @@
+"""
+Benchmark pool valuation against the per-asset Decimal loops it replaced.
+
+Each run values a fresh copy of the holdings (as every job gets a fresh
+pool from the Pool API) against one market price snapshot (as jobs on the
+same event share one from MarketPriceCache), and checks the results match:
+
+    python bench_valuation.py [--positions 500] [--repeat 200] [--depth]
+"""
+import argparse
+import copy
+import random
+import time
+from decimal import Decimal, ROUND_DOWN
+
+from valuation import PortfolioValuation
+
+def reference_nav(holdings, market_prices):
+    """The original calculate_usdc_total_from_holdings loop."""
+    usdc = Decimal(holdings.get("USDC", {}).get("amount", "0"))
+    for key, value in holdings.items():
+        if key != "USDC" and key != "NEAR":
+            if value.get("option", "YES") == "NO":
+                price = Decimal(1) - Decimal(market_prices.get(key).get("ask"))
+            else:
+                price = Decimal(market_prices.get(key).get("bid"))
+            usdc += Decimal(value.get("amount", "0")) * price
+    return usdc
+
+def reference_rebalance(holdings, percentage_pool, portfolio_total, market_prices):
+    """The original rebalance_portfolio loops."""
+    target_usdc = Decimal(percentage_pool) * Decimal(portfolio_total)
+    current_usdc = Decimal(holdings.get("USDC", {}).get("amount", "0"))
+    if current_usdc >= target_usdc:
+        return holdings, target_usdc
+    usdc_shortfall = target_usdc - current_usdc
+    new_holdings = holdings.copy()
+    non_usdc_assets = {asset: Decimal(details.get("amount", "0")) for asset, details in holdings.items() if asset not in ("USDC", "NEAR")}
+    total_non_usdc_value = Decimal(0)
+    for asset, amount in non_usdc_assets.items():
+        total_non_usdc_value += amount * Decimal(market_prices[asset]["bid"])
+    for asset, amount in non_usdc_assets.items():
+        bid_price = Decimal(market_prices[asset]["bid"])
+        amount_to_sell = usdc_shortfall * (amount * bid_price / total_non_usdc_value) / bid_price
+        new_holdings[asset] = {**holdings[asset], "amount": str((amount - amount_to_sell).quantize(Decimal("1"), rounding=ROUND_DOWN))}
+    new_holdings["USDC"] = {"amount": str(current_usdc + usdc_shortfall)}
+    new_holdings.pop("NEAR", None)
+    return new_holdings, target_usdc
+
+def make_pool(positions, depth):
+    holdings = {"USDC": {"amount": "1000.25"}, "NEAR": {"amount": "5"}}
+    market_prices = {}
+    for i in range(positions):
+        asset = f"outcome {i}"
+        bid = Decimal(random.randint(5, 90)) / 100
+        holdings[asset] = {"amount": str(random.randint(1, 10000)), "option": random.choice(("YES", "NO"))}
+        market_prices[asset] = {"bid": str(bid), "ask": str(bid + Decimal("0.02"))}
+        if depth:
+            market_prices[asset]["bids"] = [{"price": str(bid - Decimal(j) / 100), "size": "2000"} for j in range(4, -1, -1)]
+            market_prices[asset]["asks"] = [{"price": str(bid + Decimal(2 + j) / 100), "size": "2000"} for j in range(4, -1, -1)]
+    return holdings, market_prices
+
+def timed(fn, pools, market_prices, rounds=5):
+    """Milliseconds per call (best of rounds, to keep scheduler noise out) and the results."""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = [fn(holdings, market_prices) for holdings in pools]
+        elapsed = (time.perf_counter() - started) / len(pools) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pool valuation.")
+    parser.add_argument("--positions", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--depth", action="store_true", help="give every market five levels of depth (no reference to compare with)")
+    args = parser.parse_args()
+
+    holdings, market_prices = make_pool(args.positions, args.depth)
+    pools = [copy.deepcopy(holdings) for _ in range(args.repeat)]
+
+    def engine_nav(holdings, market_prices):
+        return PortfolioValuation(holdings, market_prices).nav()
+
+    def engine_both(holdings, market_prices):
+        valuation = PortfolioValuation(holdings, market_prices)
+        nav = valuation.nav()
+        return nav, valuation.rebalance("0.5", nav)
+
+    def reference_both(holdings, market_prices):
+        nav = reference_nav(holdings, market_prices)
+        return nav, reference_rebalance(holdings, "0.5", nav, market_prices)
+
+    engine_nav_ms, engine_navs = timed(engine_nav, pools, market_prices)
+    engine_both_ms, engine_results = timed(engine_both, pools, market_prices)
+    print(f"{args.positions} positions, {args.repeat} runs{' with depth' if args.depth else ''}")
+    if args.depth:
+        print(f"  nav:             {engine_nav_ms:.3f}ms")
+        print(f"  nav + rebalance: {engine_both_ms:.3f}ms")
+        return
+    reference_nav_ms, reference_navs = timed(reference_nav, pools, market_prices)
+    reference_both_ms, reference_results = timed(reference_both, pools, market_prices)
+    assert engine_navs == reference_navs and engine_results == reference_results, "results differ from the reference loops"
+    print(f"  nav:             {engine_nav_ms:.3f}ms (reference {reference_nav_ms:.3f}ms, {reference_nav_ms / engine_nav_ms:.1f}x)")
+    print(f"  nav + rebalance: {engine_both_ms:.3f}ms (reference {reference_both_ms:.3f}ms, {reference_both_ms / engine_both_ms:.1f}x)")
+
+if __name__ == "__main__":
+    main()
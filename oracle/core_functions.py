@@ -1,8 +1,11 @@
 # core_functions.py
-from py_near.account import Account
+from near_accounts import get_account
+from py_near import transactions
 from exchange import decimal_to_str
 import json
-import time
+from retry import with_retry
+from view_cache import cached_view_function, view_cache
+from log import logger, summarize
 
 def handle_buy(user_id: int, amount: float):
     """Handles the BUY operation."""
@@ -42,58 +45,39 @@ def handle_sell(user_id: int, amount: float):
 
     return usdc_received, fees
 
-async def ft_balance(pool_name, account_id, contract_id="smartpool.testnet", network="testnet"):
-    # Initialize NEAR RPC
-    node_url = f"https://rpc.{network}.near.org"
-    
-    # Load the owner's account with private key
-    owner_account = Account(rpc_addr=node_url)
+async def ft_balance(pool_name, account_id, contract_id="smartpool.testnet", network="testnet", refresh=False):
+    # Shared read-only account for view calls
+    owner_account = get_account(network=network)
     
     args = { "account_id": account_id }
-    while(True):
-        # Call the fulfill_deposit_iou function
-        try:
-            result = await owner_account.view_function(
-                f"{pool_name}.{contract_id}",
-                "ft_balance_of",
-                args=args,
-            )
-            print("Transaction successful:", result.result)
-            return result.result
-        except Exception as e:
-            print("Transaction failed, retrying:", e)
-            time.sleep(2)
-    return False
+    result = await cached_view_function(owner_account, f"{pool_name}.{contract_id}", "ft_balance_of", args, refresh)
+    logger.debug("ft_balance_of {} {}: {}", pool_name, account_id, result)
+    return result
 
-async def ft_total_supply(pool_name, contract_id="smartpool.testnet", network="testnet"):
-    # Initialize NEAR RPC
-    node_url = f"https://rpc.{network}.near.org"
-    
-    # Load the owner's account with private key
-    owner_account = Account(rpc_addr=node_url)
+async def ft_total_supply(pool_name, contract_id="smartpool.testnet", network="testnet", refresh=False, newer_than=None):
+    # Shared read-only account for view calls
+    owner_account = get_account(network=network)
     
     args = {}
-    while(True):
-        # Call the fulfill_deposit_iou function
-        try:
-            result = await owner_account.view_function(
-                f"{pool_name}.{contract_id}",
-                "ft_total_supply",
-                args=args,
-            )
-            print("Transaction successful:", result.result)
-            return result.result
-        except Exception as e:
-            print("Transaction failed, retrying:", e)
-            time.sleep(2)
-    return False
+    result = await cached_view_function(owner_account, f"{pool_name}.{contract_id}", "ft_total_supply", args, refresh, newer_than)
+    logger.debug("ft_total_supply {}: {}", pool_name, result)
+    return result
+
+def _track_mint(pool_name, contract_id, details, amount):
+    """Adds tokens the oracle just minted to the cached supply and balance instead of dropping them."""
+    contract = f"{pool_name}.{contract_id}"
+    minted = int(decimal_to_str(amount))
+    add = lambda result: str(int(result) + minted)
+    view_cache.adjust(contract, "ft_total_supply", {}, add)
+    account_id = details.get("iou", {}).get("account_id")
+    if account_id is None:
+        view_cache.invalidate(contract, "ft_balance_of")
+    else:
+        view_cache.adjust(contract, "ft_balance_of", {"account_id": account_id}, add)
 
 async def fulfill_deposit(amount, details, pool_name, owner_account_id, private_key, contract_id="smartpool.testnet", network="testnet"):
-    # Initialize NEAR RPC
-    node_url = f"https://rpc.{network}.near.org"
-    
     # Load the owner's account with private key
-    owner_account = Account(owner_account_id, private_key, rpc_addr=node_url)
+    owner_account = get_account(owner_account_id, private_key, network)
     
     # Parse out the details
     iou_id = details.get("iou", {}).get("iou_id")
@@ -105,28 +89,27 @@ async def fulfill_deposit(amount, details, pool_name, owner_account_id, private_
         "amount": decimal_to_str(amount)  # Convert to string to match U128 type
     }
     
-    while(True):
-        # Call the fulfill_deposit_iou function
-        try:
-            result = await owner_account.function_call(
-                contract_id,
-                "fulfill_deposit_iou",
-                args=args,
-                gas=200_000_000_000_000,
-            )
-            print("Transaction successful:", result)
-            return True
-        except Exception as e:
-            print("Transaction failed:", e)
-            time.sleep(2)
-    return False
+    try:
+        result = await with_retry(
+            "fulfill_deposit_iou",
+            owner_account.function_call,
+            contract_id,
+            "fulfill_deposit_iou",
+            args=args,
+            gas=200_000_000_000_000,
+        )
+    except Exception:
+        # The tokens may have been minted anyway
+        view_cache.invalidate(f"{pool_name}.{contract_id}")
+        raise
+    logger.info("fulfill_deposit_iou successful: {}", args)
+    logger.opt(lazy=True).debug("Transaction result: {}", lambda: result)
+    _track_mint(pool_name, contract_id, details, amount)
+    return True
 
 async def fulfill_withdraw(amount, details, pool_name, owner_account_id, private_key, contract_id="smartpool.testnet", network="testnet"):
-    # Initialize NEAR RPC
-    node_url = f"https://rpc.{network}.near.org"
-    
     # Load the owner's account with private key
-    owner_account = Account(owner_account_id, private_key, rpc_addr=node_url)
+    owner_account = get_account(owner_account_id, private_key, network)
     
     # Parse out the details
     iou_id = details.get("iou", {}).get("iou_id")
@@ -137,20 +120,91 @@ async def fulfill_withdraw(amount, details, pool_name, owner_account_id, private
         "pool_id": pool_name,
         "amount": decimal_to_str(amount)
     }
-    print("CAlling with", args, amount)
+    logger.info("Calling fulfill_withdraw_iou with {}", args)
     
-    # Call the fulfill_deposit_iou function
-    while(True):
+    result = await with_retry(
+        "fulfill_withdraw_iou",
+        owner_account.function_call,
+        contract_id,
+        "fulfill_withdraw_iou",
+        args=args,
+        gas=200_000_000_000_000,
+    )
+    logger.info("fulfill_withdraw_iou successful: {}", args)
+    logger.opt(lazy=True).debug("Transaction result: {}", lambda: result)
+    # Only NEAR moves: the tokens were burned by the withdraw request, so no cached view changed
+    return True
+
+# Gas attached to each fulfill action in a batched transaction. NEAR caps a
+# transaction at 300 TGas, so this also bounds how many actions fit in one.
+BATCH_ACTION_GAS = 50_000_000_000_000
+MAX_ACTIONS_PER_TX = 300_000_000_000_000 // BATCH_ACTION_GAS
+
+def _receipt_failure(outcome):
+    if outcome is None:
+        return "Receipt outcome not found"
+    return outcome.status.get("Failure") if isinstance(outcome.status, dict) else None
+
+def _action_outcomes(result, count):
+    """The receipt outcome of the pool call spawned by each action, in action order."""
+    outcomes = {outcome.receipt_id: outcome for outcome in result.receipt_outcome}
+    controller_outcome = outcomes.get(result.transaction_outcome.receipt_ids[0])
+    if controller_outcome is None:
+        return [None] * count, None
+    return [outcomes.get(receipt_id) for receipt_id in controller_outcome.receipt_ids[:count]], controller_outcome
+
+async def fulfill_ious_batch(fulfillments, pool_name, owner_account_id, private_key, contract_id="smartpool.testnet", network="testnet"):
+    """
+    Fulfills several IOUs with multi-action transactions instead of one transaction per IOU.
+
+    Parameters:
+    - fulfillments: list of (method, amount, details) where method is
+      "fulfill_deposit_iou" or "fulfill_withdraw_iou".
+
+    Returns one {"iou_id", "method", "success", "error"} dict per fulfillment, in order.
+    Up to MAX_ACTIONS_PER_TX IOUs share a transaction. If the controller
+    rejects the transaction, every IOU in it fails; otherwise each IOU's
+    result comes from the pool receipt its action spawned.
+    """
+    owner_account = get_account(owner_account_id, private_key, network)
+    results = []
+
+    for start in range(0, len(fulfillments), MAX_ACTIONS_PER_TX):
+        chunk = fulfillments[start:start + MAX_ACTIONS_PER_TX]
+        actions = []
+        for method, amount, details in chunk:
+            args = {
+                "iou_id": details.get("iou", {}).get("iou_id"),
+                "pool_id": pool_name,
+                "amount": decimal_to_str(amount)
+            }
+            actions.append(transactions.create_function_call_action(method, json.dumps(args).encode("utf8"), BATCH_ACTION_GAS, 0))
+        logger.info("Fulfilling {} IOUs in one transaction for {}", len(chunk), pool_name)
+
         try:
-            result = await owner_account.function_call(
-                contract_id,
-                "fulfill_withdraw_iou",
-                args=args,
-                gas=200_000_000_000_000,
-            )
-            print("Transaction successful:", result)
-            return True
+            result = await with_retry("fulfill IOU batch", owner_account.sign_and_submit_tx, contract_id, actions)
+            outcomes, controller_outcome = _action_outcomes(result, len(chunk))
+            transaction_failure = _receipt_failure(controller_outcome)
         except Exception as e:
-            print("Transaction failed:", e)
-            time.sleep(2)
-    return False
+            outcomes = [None] * len(chunk)
+            transaction_failure = str(e)
+            # The transaction may have executed anyway
+            view_cache.invalidate(f"{pool_name}.{contract_id}")
+
+        for (method, amount, details), outcome in zip(chunk, outcomes):
+            failure = transaction_failure or _receipt_failure(outcome)
+            if failure is None and method == "fulfill_deposit_iou":
+                _track_mint(pool_name, contract_id, details, amount)
+            elif outcome is None and transaction_failure is None:
+                # Its receipt is missing from the result, so whether it minted is unknown
+                view_cache.invalidate(f"{pool_name}.{contract_id}")
+            results.append({
+                "iou_id": details.get("iou", {}).get("iou_id"),
+                "method": method,
+                "success": failure is None,
+                "error": None if failure is None else str(failure),
+            })
+
+    logger.info("Batch results for {}: {}", pool_name, summarize(results))
+    logger.opt(lazy=True).debug("Batch results: {}", lambda: results)
+    return results
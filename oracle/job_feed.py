@@ -0,0 +1,73 @@
+import asyncio
+import os
+import time
+
+from log import logger
+
+# Seconds the Pool API holds a long-poll request open waiting for a new job
+JOB_FEED_WAIT = int(os.getenv("JOB_FEED_WAIT", "25"))
+# Bounds for the fallback polling interval (seconds)
+JOB_POLL_MIN_INTERVAL = float(os.getenv("JOB_POLL_MIN_INTERVAL", "1"))
+JOB_POLL_MAX_INTERVAL = float(os.getenv("JOB_POLL_MAX_INTERVAL", "10"))
+# How often (seconds) to try long polling again after falling back
+JOB_FEED_RETRY_INTERVAL = float(os.getenv("JOB_FEED_RETRY_INTERVAL", "60"))
+
+class JobFeed:
+    """
+    Delivers pending jobs as soon as they are queued.
+
+    Normally holds a long-poll request open on /api/jobs so the oracle wakes
+    when a new job appears. If long polling fails, or the server answers
+    straight away without new jobs (it does not support waiting), the feed
+    falls back to polling with an interval that doubles while idle and resets
+    when jobs arrive, and tries long polling again every JOB_FEED_RETRY_INTERVAL.
+    """
+    def __init__(self, pool_api, wait=JOB_FEED_WAIT, min_interval=JOB_POLL_MIN_INTERVAL,
+                 max_interval=JOB_POLL_MAX_INTERVAL, retry_interval=JOB_FEED_RETRY_INTERVAL):
+        self.pool_api = pool_api
+        self.wait = wait
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.retry_interval = retry_interval
+        self.interval = min_interval
+        self.last_job_id = 0
+        self.long_poll = True
+        self.fell_back_at = 0
+
+    def _has_new_jobs(self, jobs):
+        return any(job['id'] > self.last_job_id for job in jobs)
+
+    def _seen(self, jobs):
+        if jobs:
+            self.last_job_id = max(self.last_job_id, max(job['id'] for job in jobs))
+        return jobs
+
+    def _fall_back(self, reason):
+        logger.warning("Job feed falling back to polling: {}", reason)
+        self.long_poll = False
+        self.fell_back_at = time.monotonic()
+        self.interval = self.min_interval
+
+    async def next_jobs(self):
+        """Returns the pending jobs, waiting until there is something new or the wait times out."""
+        if not self.long_poll and time.monotonic() - self.fell_back_at > self.retry_interval:
+            self.long_poll = True
+
+        if self.long_poll:
+            started = time.monotonic()
+            jobs = await self.pool_api.wait_for_jobs(self.last_job_id, self.wait)
+            if jobs is None:
+                self._fall_back("long poll request failed")
+            elif self._has_new_jobs(jobs) or time.monotonic() - started >= self.wait / 2:
+                return self._seen(jobs)
+            else:
+                self._fall_back("server does not hold long-poll requests")
+                return self._seen(jobs)
+
+        await asyncio.sleep(self.interval)
+        jobs = await self.pool_api.fetch_jobs()
+        if self._has_new_jobs(jobs):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self._seen(jobs)
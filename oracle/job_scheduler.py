@@ -0,0 +1,105 @@
+import asyncio
+import os
+from collections import deque
+
+import metrics
+from log import logger
+
+# Maximum number of jobs (across all pools) that may run at the same time
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# Number of finished job ids remembered so a stale job list cannot run them again
+JOB_FINISHED_MEMORY = int(os.getenv("JOB_FINISHED_MEMORY", "10000"))
+
+class PoolJobScheduler:
+    """
+    Runs jobs for different pools concurrently while keeping the jobs of a
+    single pool strictly in the order they were submitted.
+
+    Each pool gets its own queue drained by one worker task, so two jobs for
+    the same pool never overlap. A shared semaphore caps how many jobs run
+    at once across all pools.
+
+    If a batch_handler is given, a run of consecutive queued jobs whose
+    actions are all in batch_actions is handed to it in one call
+    (batch_handler(pool_name, jobs)) instead of one handler call per job.
+
+    The ids of the last `finished_memory` finished jobs are remembered and
+    resubmitting them is refused: a job list the Pool API built before a
+    job's status update landed can still arrive after the job finished.
+    A job whose status update failed stays pending on the Pool API; the
+    caller resends its status rather than submitting it again.
+    """
+    def __init__(self, handler, concurrency=JOB_CONCURRENCY, batch_handler=None, batch_actions=(), finished_memory=JOB_FINISHED_MEMORY):
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.batch_actions = set(batch_actions)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues = {}
+        self.workers = {}
+        self.scheduled = set()
+        self.finished = set()
+        self.finished_order = deque()
+        self.finished_memory = finished_memory
+
+    def submit(self, job):
+        """Queues a job behind any earlier jobs for the same pool. Returns False if it is queued, running or recently finished."""
+        job_id = job['id']
+        if job_id in self.scheduled or job_id in self.finished:
+            return False
+        self.scheduled.add(job_id)
+
+        pool_name = job.get('poolName')
+        queue = self.queues.get(pool_name)
+        if queue is None:
+            queue = deque()
+            self.queues[pool_name] = queue
+            self.workers[pool_name] = asyncio.create_task(self._drain(pool_name, queue))
+        queue.append(job)
+        metrics.queue_depth.set(len(self.scheduled))
+        return True
+
+    def pending(self):
+        """Number of jobs queued or running."""
+        return len(self.scheduled)
+
+    async def join(self):
+        """Waits until every submitted job has finished."""
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+    def _finish(self, job_id):
+        self.scheduled.discard(job_id)
+        self.finished.add(job_id)
+        self.finished_order.append(job_id)
+        if len(self.finished_order) > self.finished_memory:
+            self.finished.discard(self.finished_order.popleft())
+
+    def _take_batch(self, queue):
+        jobs = [queue.popleft()]
+        if self.batch_handler is not None and jobs[0]['action'] in self.batch_actions:
+            while queue and queue[0]['action'] in self.batch_actions:
+                jobs.append(queue.popleft())
+        return jobs
+
+    async def _drain(self, pool_name, queue):
+        while True:
+            if not queue:
+                # No await between the empty check and the cleanup, so a
+                # concurrent submit() either lands in this queue first or
+                # creates a fresh worker afterwards.
+                del self.queues[pool_name]
+                del self.workers[pool_name]
+                return
+            jobs = self._take_batch(queue)
+            try:
+                async with self.semaphore:
+                    if len(jobs) > 1:
+                        await self.batch_handler(pool_name, jobs)
+                    else:
+                        await self.handler(jobs[0])
+            except Exception as e:
+                logger.exception("Unhandled error in jobs {} for pool {}: {}", [job['id'] for job in jobs], pool_name, e)
+            finally:
+                for job in jobs:
+                    self._finish(job['id'])
+                metrics.queue_depth.set(len(self.scheduled))
@@ -0,0 +1,135 @@
+import codecs
+import json
+import re
+
+_STRUCTURE = re.compile(r'[{}\[\]:,"]')
+_STRING_END = re.compile(r'["\\]')
+
+class FileContentFinder:
+    """
+    Finds the "content" of the first object whose "filename" matches, in a
+    JSON document fed in chunks.
+
+    Only the current nesting path is kept, plus the content of an object
+    whose filename has already matched. feed() returns the content as soon
+    as it is known; later chunks need not be read.
+
+    Other strings (keys, filenames, and "content" whose object's filename
+    is not known yet, such as transcript messages) are buffered only up to
+    early_limit characters, so memory stays bounded however large the
+    document is. If the wanted object has its "content" before its
+    "filename" and that content is longer than early_limit, it is lost:
+    feed() never returns it and `truncated` is set.
+    """
+    def __init__(self, filename="index.html", early_limit=65536):
+        self.filename = filename
+        self.early_limit = early_limit
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # One entry per open container: a dict for objects, None for arrays
+        self.stack = []
+        self.expect_key = False
+        self.in_string = False
+        self.escaped = False
+        # Raw pieces of the string being read, or None if it is not needed
+        self.string = None
+        self.string_size = 0
+        # Most characters to buffer for the current string (None for no limit)
+        self.string_limit = None
+        self.string_is_key = False
+        self.result = None
+        self.truncated = False
+
+    def feed(self, chunk):
+        """Consumes the next bytes (or str) of the document. Returns the content once found, else None."""
+        if self.result is not None:
+            return self.result
+        text = self.decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        pos = 0
+        while pos < len(text) and self.result is None:
+            pos = self._read_string(text, pos) if self.in_string else self._read_structure(text, pos)
+        return self.result
+
+    def _read_structure(self, text, pos):
+        match = _STRUCTURE.search(text, pos)
+        if match is None:
+            # Numbers, true/false/null and whitespace carry nothing we need
+            return len(text)
+        char = match.group()
+        top = self.stack[-1] if self.stack else None
+        if char == '"':
+            self.in_string = True
+            self.string_is_key = top is not None and self.expect_key
+            self.string = None
+            self.string_size = 0
+            self.string_limit = self.early_limit
+            if self.string_is_key or (top is not None and top["key"] == "filename"):
+                self.string = []
+            elif top is not None and top["key"] == "content" and top["filename"] in (None, self.filename):
+                self.string = []
+                if top["filename"] == self.filename:
+                    self.string_limit = None
+        elif char == "{":
+            self.stack.append({"key": None, "filename": None, "content": None, "dropped": False})
+            self.expect_key = True
+        elif char == "[":
+            self.stack.append(None)
+        elif char in "}]":
+            if self.stack:
+                self.stack.pop()
+            self.expect_key = False
+        elif char == ",":
+            self.expect_key = top is not None
+        else:
+            self.expect_key = False
+        return match.end()
+
+    def _read_string(self, text, pos):
+        start = pos
+        while True:
+            if self.escaped:
+                if pos >= len(text):
+                    self._keep(text[start:])
+                    return len(text)
+                # The escaped character (or the first of \uXXXX) can never end the string
+                self.escaped = False
+                pos += 1
+            match = _STRING_END.search(text, pos)
+            if match is None:
+                self._keep(text[start:])
+                return len(text)
+            if match.group() == "\\":
+                self.escaped = True
+                pos = match.end()
+                continue
+            self._keep(text[start:match.start()])
+            self.in_string = False
+            self._end_string()
+            return match.end()
+
+    def _keep(self, piece):
+        if self.string is None:
+            return
+        self.string_size += len(piece)
+        if self.string_limit is not None and self.string_size > self.string_limit:
+            # Too long to hold on the chance it is wanted; remember a dropped content
+            if not self.string_is_key and self.stack[-1]["key"] == "content":
+                self.stack[-1]["dropped"] = True
+            self.string = None
+            return
+        self.string.append(piece)
+
+    def _end_string(self):
+        if self.string is None:
+            return
+        value = json.loads('"' + "".join(self.string) + '"')
+        self.string = None
+        top = self.stack[-1]
+        if self.string_is_key:
+            top["key"] = value
+            return
+        top[top["key"]] = value
+        if top["filename"] == self.filename:
+            if top["content"] is not None:
+                self.result = top["content"]
+            elif top["dropped"]:
+                self.truncated = True
@@ -0,0 +1,384 @@
+"""
+Synthetic load test for the oracle.
+
+Starts an in-process stand-in for the Pool API and for NEAR JSON-RPC, both
+with configurable latency and failure rates, queues N pools x M mixed
+buy/sell/deposit/withdraw jobs, and runs the unmodified run_job_processor
+against them until every job has finished. Reports throughput, job latency
+percentiles and memory:
+
+    LOG_LEVEL=WARNING python loadgen.py --pools 20 --jobs 50 --rpc-latency 0.2
+
+Jobs are all queued up front unless --rate gives an arrival rate (jobs/sec).
+Environment settings such as JOB_CONCURRENCY and NET_POOL_FLOWS apply as usual.
+"""
+import argparse
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import base58
+from aiohttp import web
+from nacl import signing
+
+YOCTO = 10 ** 24
+JOB_ACTIONS = {"buy": "buy", "sell": "sell", "deposit": "fulfillDeposit", "withdraw": "fulfillWithdraw"}
+
+class Latency:
+    """Simulated service time and failure rate of one fake service."""
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    async def wait(self):
+        """Sleeps for the simulated latency. Returns False if this request should fail."""
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        return random.random() >= self.failure_rate
+
+class FakePoolApi:
+    """In-memory stand-in for the Pool API routes the oracle uses."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.pools = {}
+        self.prices = {}
+        self.jobs = {}
+        self.next_job_id = 1
+        self.queued_at = {}
+        self.finished_at = {}
+        self.statuses = {}
+        self.actions = 0
+        self.job_added = asyncio.Condition()
+        self.all_done = asyncio.Event()
+
+    def add_pool(self, name, assets):
+        holdings = {"USDC": {"amount": "100000", "costBasis": "1"}}
+        prices = {}
+        for i in range(assets):
+            asset = f"{name} outcome {i}"
+            bid = Decimal(random.randint(5, 90)) / 100
+            holdings[asset] = {"amount": str(random.randint(100, 10000)), "costBasis": str(bid), "option": "YES"}
+            ask = bid + Decimal("0.02")
+            prices[asset] = {
+                "bid": str(bid),
+                "ask": str(ask),
+                # Five levels a side, best last as the CLOB returns them
+                "bids": [{"price": str(bid - Decimal(i) / 100), "size": str(random.randint(500, 5000))} for i in range(4, -1, -1)],
+                "asks": [{"price": str(ask + Decimal(i) / 100), "size": str(random.randint(500, 5000))} for i in range(4, -1, -1)],
+            }
+        self.pools[name] = {"name": name, "markets": [f"https://polymarket.com/event/{name}?tid=1"], "holdings": holdings}
+        self.prices[name] = prices
+
+    async def add_job(self, pool_name, action, details):
+        job = {
+            "id": self.next_job_id,
+            "poolName": pool_name,
+            "action": action,
+            "details": details,
+            "status": "pending",
+            "createdAt": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+        self.next_job_id += 1
+        self.jobs[job["id"]] = job
+        self.queued_at[job["id"]] = time.perf_counter()
+        self.all_done.clear()
+        async with self.job_added:
+            self.job_added.notify_all()
+
+    def pending_jobs(self):
+        return [job for job in self.jobs.values() if job["status"] == "pending"]
+
+    async def _respond(self, handler, request):
+        if not await self.latency.wait():
+            return web.json_response({"error": "Injected failure"}, status=503)
+        return await handler(request)
+
+    def routes(self):
+        def route(handler):
+            return lambda request: self._respond(handler, request)
+        return [
+            web.get("/api/jobs", self.get_jobs),  # Long-poll requests are not delayed by latency
+            web.post("/api/jobs", route(self.post_job_status)),
+            web.get("/api/pool", route(self.get_pool)),
+            web.post("/api/pool", route(self.post_pool)),
+            web.post("/api/add_pool_holdings", route(self.post_add_pool_holdings)),
+            web.post("/api/apply_pool_changes", route(self.post_apply_pool_changes)),
+            web.post("/api/actions", route(self.post_action)),
+            web.get("/api/market_prices", route(self.get_market_prices)),
+        ]
+
+    async def get_jobs(self, request):
+        wait = float(request.query.get("wait", 0))
+        after = int(request.query.get("after", 0))
+        if wait > 0:
+            async with self.job_added:
+                try:
+                    await asyncio.wait_for(
+                        self.job_added.wait_for(lambda: any(job["id"] > after for job in self.pending_jobs())),
+                        wait,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        return web.json_response(self.pending_jobs())
+
+    async def post_job_status(self, request):
+        body = await request.json()
+        job = self.jobs[body["jobId"]]
+        job["status"] = body["status"]
+        self.statuses[body["status"]] = self.statuses.get(body["status"], 0) + 1
+        self.finished_at[job["id"]] = time.perf_counter()
+        if not self.pending_jobs():
+            self.all_done.set()
+        return web.json_response({"message": f"Job {job['id']} status updated to {job['status']}"})
+
+    async def get_pool(self, request):
+        return web.json_response(copy.deepcopy(self.pools[request.query["name"]]))
+
+    async def post_pool(self, request):
+        body = await request.json()
+        self.pools[request.query["name"]]["holdings"] = body["holdings"]
+        return web.json_response(self.pools[request.query["name"]])
+
+    def _add(self, pool_name, asset_name, amount, cost_basis):
+        holdings = self.pools[pool_name]["holdings"]
+        entry = holdings.setdefault(asset_name, {"amount": "0", "costBasis": cost_basis})
+        entry["amount"] = str(Decimal(entry["amount"]) + Decimal(amount))
+
+    async def post_add_pool_holdings(self, request):
+        body = await request.json()
+        self._add(body["poolName"], body["assetName"], body["amount"], body.get("costBasis", "0"))
+        return web.json_response(self.pools[body["poolName"]])
+
+    async def post_apply_pool_changes(self, request):
+        body = await request.json()
+        for change in body["changes"]:
+            self._add(body["poolName"], change["assetName"], change["amount"], change.get("costBasis", "0"))
+        self.actions += 1
+        return web.json_response(self.pools[body["poolName"]])
+
+    async def post_action(self, request):
+        self.actions += 1
+        return web.json_response({"success": True})
+
+    async def get_market_prices(self, request):
+        return web.json_response(self.prices[request.query["event_name"]])
+
+class FakeNearRpc:
+    """
+    Stand-in for a NEAR JSON-RPC node. Answers the status, access key and
+    view (ft_total_supply, ft_balance_of) queries py_near makes, and accepts
+    every signed transaction as successful.
+
+    Like a node, it executes a signed transaction once: sending it again
+    returns the first result, and "tx" looks results up by hash. With a
+    lost_rate, that share of transactions execute but their response is
+    lost (HTTP 503), as when an RPC call times out after the transaction
+    landed.
+    """
+    def __init__(self, latency, total_supply=1000 * YOCTO, actions_per_tx=16, lost_rate=0.0):
+        self.latency = latency
+        self.lost_rate = lost_rate
+        self.executed = {}
+        self.lost = 0
+        self.total_supply = total_supply
+        self.actions_per_tx = actions_per_tx
+        self.started = time.monotonic()
+        self.transactions = 0
+        self.calls = {}
+
+    def block(self):
+        height = 1000 + int((time.monotonic() - self.started) / 0.6)
+        block_hash = base58.b58encode(hashlib.sha256(str(height).encode()).digest()).decode()
+        return height, block_hash
+
+    def routes(self):
+        return [web.post("/", self.handle)]
+
+    async def handle(self, request):
+        body = await request.json()
+        method = body["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if not await self.latency.wait():
+            return web.Response(status=503, text="Injected failure")
+        height, block_hash = self.block()
+        if method == "status":
+            result = {"chain_id": "loadgen", "sync_info": {"latest_block_hash": block_hash, "latest_block_height": height}}
+        elif method == "query":
+            result = self.query(body["params"], height, block_hash)
+        elif method in ("broadcast_tx_commit", "send_tx"):
+            result = self.transaction(body["params"][0])
+            if random.random() < self.lost_rate:
+                self.lost += 1
+                return web.Response(status=503, text="Injected lost response")
+        elif method == "tx" and body["params"][0] in self.executed:
+            result = self.executed[body["params"][0]]
+        elif method == "tx":
+            return web.json_response({"jsonrpc": "2.0", "id": body.get("id"), "error": {"cause": {"name": "UNKNOWN_TRANSACTION"}, "data": "unknown"}})
+        else:
+            return web.json_response({"jsonrpc": "2.0", "id": body.get("id"), "error": {"cause": {"name": "UNKNOWN_METHOD"}, "data": method}})
+        return web.json_response({"jsonrpc": "2.0", "id": body.get("id"), "result": result})
+
+    def query(self, params, height, block_hash):
+        if params["request_type"] == "view_access_key":
+            return {"nonce": 0, "permission": "FullAccess", "block_height": height, "block_hash": block_hash}
+        if params["method_name"] == "ft_total_supply":
+            value = str(self.total_supply)
+        else:
+            value = str(YOCTO)
+        return {"result": list(json.dumps(value).encode()), "logs": [], "block_height": height, "block_hash": block_hash}
+
+    @staticmethod
+    def _outcome(receipt_id, receipt_ids, status):
+        return {
+            "id": receipt_id,
+            "outcome": {"logs": [], "metadata": {}, "receipt_ids": receipt_ids, "status": status, "tokens_burnt": "0", "gas_burnt": 0},
+        }
+
+    def transaction(self, signed_tx):
+        # The hash covers the transaction without its signature (key type byte + 64 byte ed25519 signature)
+        tx_hash = base58.b58encode(hashlib.sha256(base64.b64decode(signed_tx)[:-65]).digest()).decode()
+        if tx_hash in self.executed:
+            return self.executed[tx_hash]
+        self.transactions += 1
+        controller_id = f"{tx_hash}-controller"
+        # One successful pool receipt per possible action, so multi-action transactions see every action succeed
+        pool_ids = [f"{tx_hash}-pool-{i}" for i in range(self.actions_per_tx)]
+        result = self.executed[tx_hash] = {
+            "status": {"SuccessValue": ""},
+            "transaction": {
+                "hash": tx_hash, "public_key": "", "receiver_id": "", "signature": "",
+                "signer_id": "", "nonce": 0, "actions": [],
+            },
+            "transaction_outcome": self._outcome(tx_hash, [controller_id], {"SuccessReceiptId": controller_id}),
+            "receipts_outcome": [self._outcome(controller_id, pool_ids, {"SuccessValue": ""})]
+                + [self._outcome(pool_id, [], {"SuccessValue": ""}) for pool_id in pool_ids],
+        }
+        return result
+
+def job_details(kind, pool, iou_id):
+    if kind in ("buy", "sell"):
+        asset = random.choice([asset for asset in pool["holdings"] if asset != "USDC"])
+        return {"choice": ["yes", asset], "amount": str(random.randint(1, 20))}
+    if kind == "deposit":
+        amount = random.randint(1, 100) * YOCTO // 10
+    else:
+        amount = random.randint(1, 10) * YOCTO // 100
+    return {"iou": {"iou_id": iou_id, "account_id": f"user{iou_id}.testnet", "amount": str(amount)}}
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in JOB_ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown job kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def start_site(routes):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+async def run(args):
+    random.seed(args.seed)
+    pool_api = FakePoolApi(Latency(args.api_latency, args.api_failure_rate))
+    rpc = FakeNearRpc(Latency(args.rpc_latency, args.rpc_failure_rate), lost_rate=args.rpc_lost_rate)
+    api_runner, api_url = await start_site(pool_api.routes())
+    rpc_runner, rpc_url = await start_site(rpc.routes())
+
+    # The oracle reads its endpoints from the environment when it is imported
+    os.environ["SMARTPOOL_URL"] = api_url
+    os.environ["NEAR_RPC_URL"] = rpc_url
+    os.environ.setdefault("METRICS_PORT", "0")
+    if "OWNER_PRIVATE_KEY" not in os.environ:
+        key = signing.SigningKey.generate()
+        os.environ["OWNER_PRIVATE_KEY"] = "ed25519:" + base58.b58encode(key.encode() + key.verify_key.encode()).decode()
+    import main
+    from near_accounts import close_accounts
+
+    for i in range(args.pools):
+        pool_api.add_pool(f"pool{i}", args.assets)
+    kinds, weights = zip(*args.mix.items())
+    work = [(f"pool{i}", random.choices(kinds, weights)[0]) for i in range(args.pools) for _ in range(args.jobs)]
+    random.shuffle(work)
+
+    async def generate():
+        for iou_id, (pool_name, kind) in enumerate(work, 1):
+            await pool_api.add_job(pool_name, JOB_ACTIONS[kind], job_details(kind, pool_api.pools[pool_name], iou_id))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    processor = asyncio.create_task(main.run_job_processor())
+    await generate()
+    await pool_api.all_done.wait()
+    elapsed = time.perf_counter() - started
+    processor.cancel()
+    await asyncio.gather(processor, return_exceptions=True)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    await main.pool_api.close()
+    await close_accounts()
+    await api_runner.cleanup()
+    await rpc_runner.cleanup()
+
+    latencies = [pool_api.finished_at[job_id] - pool_api.queued_at[job_id] for job_id in pool_api.finished_at]
+    lines = [
+        f"{len(latencies)} jobs ({args.pools} pools x {args.jobs}) in {elapsed:.2f}s: {len(latencies) / elapsed:.1f} jobs/sec",
+        f"  statuses: {pool_api.statuses}",
+        "  latency: " + " ".join(f"p{int(p * 100)}={percentile(latencies, p) * 1000:.0f}ms" for p in (0.5, 0.9, 0.99))
+            + f" max={max(latencies) * 1000:.0f}ms",
+        f"  NEAR RPC: {rpc.transactions} transactions ({rpc.lost} responses lost), calls {rpc.calls}",
+        f"  Pool API actions recorded: {pool_api.actions}",
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        f"  peak RSS: {rss_after / (1024 if sys.platform != 'darwin' else 1024 ** 2):.1f} MB"
+            f" (+{(rss_after - rss_before) / (1024 if sys.platform != 'darwin' else 1024 ** 2):.1f} MB during the run)",
+    ]
+    if traced_peak is not None:
+        lines.append(f"  peak traced Python memory: {traced_peak / 1024 ** 2:.1f} MB")
+    print("\n".join(lines))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the oracle against fake Pool API and NEAR RPC services.")
+    parser.add_argument("--pools", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=20, help="jobs per pool")
+    parser.add_argument("--assets", type=int, default=5, help="market assets held by each pool")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("buy=1,sell=1,deposit=1,withdraw=1"),
+                        help="weighted job kinds, e.g. buy=2,sell=1,deposit=1,withdraw=1")
+    parser.add_argument("--rate", type=float, default=0, help="job arrival rate (jobs/sec); 0 queues everything at once")
+    parser.add_argument("--api-latency", type=float, default=0.005, help="mean Pool API response time (seconds)")
+    parser.add_argument("--api-failure-rate", type=float, default=0.0)
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="mean NEAR RPC response time (seconds)")
+    parser.add_argument("--rpc-failure-rate", type=float, default=0.0)
+    parser.add_argument("--rpc-lost-rate", type=float, default=0.0, help="share of transactions that execute but lose their response")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report peak Python allocations (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
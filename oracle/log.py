@@ -0,0 +1,60 @@
+import os
+import sys
+from collections import defaultdict
+
+from loguru import logger
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Emit one JSON object per line instead of human-readable text
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1"
+# How many items of a large dict/list to show when it is summarized
+LOG_SUMMARY_ITEMS = int(os.getenv("LOG_SUMMARY_ITEMS", "5"))
+LOG_SUMMARY_CHARS = int(os.getenv("LOG_SUMMARY_CHARS", "200"))
+
+_sample_counts = defaultdict(int)
+_full_dumps = False
+
+def _sample_filter(record):
+    """Messages logged with logger.bind(sample=N) are only written once every N calls from that line."""
+    sample = record["extra"].get("sample")
+    if not sample or sample <= 1:
+        return True
+    key = (record["file"].path, record["line"])
+    _sample_counts[key] += 1
+    return _sample_counts[key] % sample == 1
+
+def setup_logging(level=LOG_LEVEL, serialize=LOG_JSON, sink=sys.stderr):
+    """
+    Routes all oracle logging (including py_near's) through one sink.
+    enqueue=True hands records to a background writer thread so logging
+    never blocks a job on stdout/stderr I/O.
+    """
+    global _full_dumps
+    _full_dumps = logger.level(level).no <= logger.level("DEBUG").no
+    logger.remove()
+    logger.add(
+        sink,
+        level=level,
+        enqueue=True,
+        serialize=serialize,
+        filter=_sample_filter,
+        format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <7} | {name}:{line} | {message}",
+    )
+
+def summarize(value, items=LOG_SUMMARY_ITEMS, chars=LOG_SUMMARY_CHARS):
+    """Short description of a (possibly large) object. At DEBUG level the object is returned in full."""
+    if _full_dumps:
+        return value
+    if isinstance(value, dict):
+        keys = list(value)
+        shown = ", ".join(str(key) for key in keys[:items])
+        more = f", ... +{len(keys) - items}" if len(keys) > items else ""
+        return f"<dict {len(keys)} keys: {shown}{more}>"
+    if isinstance(value, (list, tuple)):
+        return f"<{type(value).__name__} {len(value)} items>"
+    text = str(value)
+    if len(text) > chars:
+        return f"{text[:chars]}... <{len(text)} chars>"
+    return text
+
+setup_logging()
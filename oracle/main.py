@@ -2,61 +2,122 @@ import asyncio
 import json
 import traceback
 import os
-import urllib.request
+import sys
 import time
-
-from core_functions import handle_buy, handle_sell, fulfill_deposit, ft_balance, fulfill_withdraw, ft_total_supply
-from exchange import swap_near_to_usdc, calculate_usdc_total_from_holdings, rebalance_portfolio, swap_usdc_to_near, decimal_to_str
-from pool_api_client import PoolApiClient
+from datetime import datetime
+
+import aiohttp
+
+from core_functions import handle_buy, handle_sell, fulfill_deposit, ft_balance, fulfill_withdraw, ft_total_supply, fulfill_ious_batch
+from exchange import swap_near_to_usdc, calculate_usdc_total_from_holdings, rebalance_portfolio, swap_usdc_to_near, decimal_to_str, USD_CONVERSION_RATE
+from pool_api_client import AsyncPoolApiClient
+from valuation import PortfolioValuation
+from job_scheduler import PoolJobScheduler
+from job_feed import JobFeed
+from price_cache import MarketPriceCache
+from netting import plan_pool_flows
+from order_book import OrderBook
+from ai_runner import NearAiRunner
+from json_stream import FileContentFinder
+import replay
+import metrics
+from log import logger, summarize
 from decimal import Decimal, ROUND_DOWN
 
 # Set up PoolApiClient with the AILP URL
 SMARTPOOL_URL = os.getenv('SMARTPOOL_URL', 'http://localhost:3000')
 NEAR_CONFIG=os.getenv("NEAR_CONFIG", "")
 NEARAI_CALLBACK_URL=os.getenv("NEARAI_CALLBACK_URL", "")
-pool_api = PoolApiClient(SMARTPOOL_URL)
-
-def fetch_jobs():
+# Seconds to wait for a NEAR AI agent run to finish
+NEAR_AI_TIMEOUT = float(os.getenv("NEAR_AI_TIMEOUT", "300"))
+# Bytes read at a time from a NEAR AI run response
+NEAR_AI_READ_CHUNK = int(os.getenv("NEAR_AI_READ_CHUNK", "65536"))
+# Net queued deposits and withdrawals for a pool into one swap (see process_fulfill_batch)
+NET_POOL_FLOWS = os.getenv("NET_POOL_FLOWS", "0") == "1"
+# Record every job and its I/O to this file for offline replay (see replay.py)
+ORACLE_RECORD = os.getenv("ORACLE_RECORD", "")
+pool_api = AsyncPoolApiClient(SMARTPOOL_URL)
+# Market prices shared by all jobs on the same event
+price_cache = MarketPriceCache(pool_api.get_market_prices)
+# Background NEAR AI runs for runAI jobs; looks call_near_ai_api up at call time so replay can patch it
+ai_runner = NearAiRunner(lambda *args: call_near_ai_api(*args))
+_near_ai_session = None
+
+async def fetch_jobs():
     """Fetches pending jobs from the Pool API."""
-    return pool_api.fetch_jobs()
-
-def update_job_status(job_id, status, details=None):
-    """Updates the job status via the Pool API."""
-    pool_api.update_job_status(job_id, status, details)
-
-# Function to recursively search for 'content' in nested JSON structure
-def find_html_content(data):
-    if isinstance(data, dict):
-        # Check for the content in a dict format
-        if "filename" in data and data["filename"] == "index.html":
-            return data.get("content")
-        for key, value in data.items():
-            result = find_html_content(value)
-            if result:
-                return result
-    elif isinstance(data, list):
-        # Loop through list elements
-        for item in data:
-            result = find_html_content(item)
-            if result:
-                return result
+    return await pool_api.fetch_jobs()
+
+def job_age(job):
+    """Seconds since the job was created, or None if the Pool API did not say."""
+    try:
+        created_at = datetime.fromisoformat(job['createdAt'].replace('Z', '+00:00'))
+        return time.time() - created_at.timestamp()
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+def mark_received(job):
+    """Stamps a fetched job with the monotonic time the oracle first saw it."""
+    job.setdefault('_received_at', time.monotonic())
+
+def job_received_at(job):
+    """
+    When the oracle first saw the job (time.monotonic()); anything the job's
+    request changed on chain had already happened by then. Now for a job
+    that was not stamped, so reads must be fresh.
+    """
+    return job.get('_received_at', time.monotonic())
+
+def observe_pickup(job):
+    age = job_age(job)
+    if age is not None:
+        metrics.job_age_seconds.observe(age, action=job['action'])
+
+# Statuses the Pool API did not accept, by job id. The scheduler will not
+# run a finished job again, so these are resent while the job is listed as pending.
+unsent_job_statuses = {}
+
+async def update_job_status(job_id, status, details=None):
+    """Updates the job status via the Pool API, keeping it for a resend if the update fails."""
+    if await pool_api.update_job_status(job_id, status, details):
+        unsent_job_statuses.pop(job_id, None)
+    else:
+        unsent_job_statuses[job_id] = (status, details)
+
+async def find_html_content(chunks):
+    """
+    Returns the content of the index.html file entry in a streamed JSON
+    response, or None. Stops reading as soon as the entry has been parsed.
+    """
+    finder = FileContentFinder("index.html")
+    async for chunk in chunks:
+        content = finder.feed(chunk)
+        if content is not None:
+            return content
+    if finder.truncated:
+        logger.warning("index.html content came before its filename and exceeded {} characters", finder.early_limit)
     return None
 
-def call_near_ai_api(pool_name, prediction_market_url, usdc_available, holdings):
+def near_ai_session():
+    """Returns the aiohttp session shared by all NEAR AI runs."""
+    global _near_ai_session
+    if _near_ai_session is None or _near_ai_session.closed:
+        _near_ai_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=NEAR_AI_TIMEOUT))
+    return _near_ai_session
+
+async def call_near_ai_api(pool_names, prediction_market_url, usdc_available, holdings):
+    """
+    Runs the prediction agent on one market; it calls back every pool in
+    pool_names with its recommendation. Returns the agent's index.html output.
+    """
     url = "https://api.near.ai/v1/agent/runs"
-    print("NEAR_C", NEAR_CONFIG)
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {NEAR_CONFIG}'
     }
-    new_message = {
-        "prediction_market_url": prediction_market_url,
-        "usdc_available": usdc_available,
-        "holdings": holdings
-    }
     new_message = {
         "url": prediction_market_url,
-        "pool_name": pool_name,
+        "pool_name": pool_names[0],
+        "pool_names": pool_names,
         "callback_url": NEARAI_CALLBACK_URL,
         "holdings": holdings,
         "usdc_available": usdc_available
@@ -66,33 +127,37 @@ def call_near_ai_api(pool_name, prediction_market_url, usdc_available, holdings)
         "agent_id": "smartpool.near/prediction-market-assistant/0.1.1",
         "new_message": json.dumps(new_message),
         "max_iterations": 1
-    }).encode("utf-8")
+    })
 
-    req = urllib.request.Request(url, data=payload, headers=headers)
     try:
-        print("Calling...", url, payload, headers)
-        with urllib.request.urlopen(req) as response:
-            result = response.read()
-            print("RESULT")
-            print(result)
-            return result.decode("utf-8")
-    except Exception as e:
-        print(f"Error calling NEAR AI API: {e}")
+        logger.info("Calling NEAR AI agent for {} on {}", pool_names, prediction_market_url)
+        logger.opt(lazy=True).debug("NEAR AI payload: {}", lambda: payload)
+        async with near_ai_session().post(url, data=payload, headers=headers) as response:
+            response.raise_for_status()
+            # Run responses carry the whole transcript; only the output file is kept
+            result = await find_html_content(response.content.iter_chunked(NEAR_AI_READ_CHUNK))
+            if result is None:
+                logger.warning("NEAR AI response for {} has no index.html", pool_names)
+            logger.debug("NEAR AI output: {}", summarize(result))
+            return result
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("Error calling NEAR AI API: {}", e)
         return None
 
 def runAI(pool, pool_name):
+    """Starts a background NEAR AI run for every market of the pool. Returns the run tasks."""
     # TODO needs current prices
-    print("--", pool)
+    logger.debug("Running AI for pool {}", summarize(pool))
     usdc = pool["holdings"]["USDC"]["amount"]
-    holdings = pool["holdings"]
-    if "NEAR" in holdings:
-        del holdings["NEAR"]
-    if "USDC" in holdings:
-        del holdings["USDC"]
-    response = call_near_ai_api(pool_name, "https://polymarket.com/event/when-will-gpt-5-be-announced?tid=1729566306341", usdc, holdings)
-    print("___", response)
+    holdings = {asset: holding for asset, holding in pool["holdings"].items() if asset not in ("NEAR", "USDC")}
+    return [ai_runner.submit(pool_name, market_url, usdc, holdings) for market_url in pool["markets"]]
 
 async def process_job(job):
+    observe_pickup(job)
+    with metrics.job_seconds.time(action=job['action']):
+        await _process_job(job)
+
+async def _process_job(job):
     job_id = job['id']
     action = job['action']
     details = job['details']
@@ -101,50 +166,72 @@ async def process_job(job):
     private_key = os.getenv("OWNER_PRIVATE_KEY", None)
     
     if private_key is None:
-        print("MUST SET OWNER_PRIVATE_KEY!!")
+        logger.error("MUST SET OWNER_PRIVATE_KEY!!")
         return
     
-    print("--", job)
+    logger.info("Processing job {} ({}) for {}", job_id, action, pool_name)
+    logger.debug("Job: {}", summarize(job))
 
     try:
         if action == 'buy':
-            pool = pool_api.get_pool(pool_name)
-            market_prices = pool_api.get_market_prices(pool)
+            pool = await pool_api.get_pool(pool_name)
+            market_prices = (await price_cache.get(pool)).require_fresh()
             key = details["choice"][1]
-            amount = Decimal(details["amount"])
-            ask = Decimal(market_prices.get(key).get("ask"))
+            requested = Decimal(details["amount"])
+            # Walk the asks: large orders fill at a worse average price, or only partly
+            ask, amount = OrderBook.from_prices(market_prices.get(key)).buy(requested)
+            if not amount:
+                raise RuntimeError(f"No asks to fill BUY of {key} for {pool_name}")
+            if amount < requested:
+                logger.warning("Only {} of {} {} can be bought for {}", amount, requested, key, pool_name)
             cost_usdc = -amount * ask
-            pool_api.add_pool_holdings(pool_name, key, decimal_to_str(amount), decimal_to_str(ask, "0.001"))
-            pool_api.add_pool_holdings(pool_name, "USDC", decimal_to_str(cost_usdc, "0.01"), decimal_to_str(ask, "0.001"))
-            pool_api.record_action(
+            applied = await pool_api.apply_pool_changes(
                 pool_name,
+                [
+                    (key, decimal_to_str(amount), decimal_to_str(ask, "0.001")),
+                    ("USDC", decimal_to_str(cost_usdc, "0.01"), decimal_to_str(ask, "0.001")),
+                ],
                 "BUY",
                 "NEAR AI",
                 details={
+                    "requested_amount": decimal_to_str(requested),
+                    "average_price": decimal_to_str(ask, "0.000001"),
                 }
             )
+            if not applied:
+                raise RuntimeError(f"Failed to book BUY for {pool_name}")
         
         elif action == 'sell':
-            pool = pool_api.get_pool(pool_name)
-            market_prices = pool_api.get_market_prices(pool)
+            pool = await pool_api.get_pool(pool_name)
+            market_prices = (await price_cache.get(pool)).require_fresh()
             key = details["choice"][1]
-            amount = Decimal(details["amount"])
-            bid = Decimal(market_prices.get(key).get("bid"))
+            requested = Decimal(details["amount"])
+            bid, amount = OrderBook.from_prices(market_prices.get(key)).sell(requested)
+            if not amount:
+                raise RuntimeError(f"No bids to fill SELL of {key} for {pool_name}")
+            if amount < requested:
+                logger.warning("Only {} of {} {} can be sold for {}", amount, requested, key, pool_name)
             usdc = amount * bid
-            pool_api.add_pool_holdings(pool_name, "USDC", decimal_to_str(usdc, "0.01"))
-            pool_api.add_pool_holdings(pool_name, key, decimal_to_str(-amount))
-            pool_api.record_action(
+            applied = await pool_api.apply_pool_changes(
                 pool_name,
+                [
+                    ("USDC", decimal_to_str(usdc, "0.01")),
+                    (key, decimal_to_str(-amount)),
+                ],
                 "SELL",
                 "NEAR AI",
                 details={
+                    "requested_amount": decimal_to_str(requested),
+                    "average_price": decimal_to_str(bid, "0.000001"),
                 }
             )
+            if not applied:
+                raise RuntimeError(f"Failed to book SELL for {pool_name}")
 
         elif action == 'runAI':
-            pool = pool_api.get_pool(pool_name)
-            runAI(pool, pool_name)
-            pool_api.record_action(
+            pool = await pool_api.get_pool(pool_name)
+            runs = runAI(pool, pool_name)
+            await pool_api.record_action(
                 pool_name,
                 "AI CALL",
                 "Platform",
@@ -152,7 +239,7 @@ async def process_job(job):
                 }
             )
 
-            print(f"NEAR AI run executed")
+            logger.info("Started {} NEAR AI runs for {}", len(runs), pool_name)
 
         elif action == 'fulfillDeposit':
             account_id = details["iou"]["account_id"]
@@ -161,10 +248,11 @@ async def process_job(job):
             # Step 1: Calculate operational fee and net deposit amount
             operational_fee = near_amount * Decimal('0.01')  # 1% operational fee
             near_after_fee = near_amount - operational_fee
-            usdc_received, fees = await swap_near_to_usdc(near_after_fee, pool_name, owner_account_id, private_key)
+            with metrics.stage_seconds.time(stage="swap near_to_usdc"):
+                usdc_received, fees = await swap_near_to_usdc(near_after_fee, pool_name, owner_account_id, private_key)
 
             # Step 2: Record the SWAP action in the pool’s history
-            pool_api.record_action(
+            await pool_api.record_action(
                 pool_name,
                 "SWAP",
                 "Platform",
@@ -178,16 +266,16 @@ async def process_job(job):
             )
 
             # Step 3: Get current pool USDC holdings BEFORE adding new usdc_received
-            pool = pool_api.get_pool(pool_name)
-            market_prices = pool_api.get_market_prices(pool)
-            current_usdc_holdings = calculate_usdc_total_from_holdings(pool["holdings"], market_prices, "ASK")
+            pool = await pool_api.get_pool(pool_name)
+            market_prices = (await price_cache.get(pool)).require_fresh()
+            with metrics.stage_seconds.time(stage="valuation"):
+                current_usdc_holdings = calculate_usdc_total_from_holdings(pool["holdings"], market_prices, "ASK")
             pool_total_value_before = Decimal(current_usdc_holdings)
 
             # Step 4: Get current total token supply in standard units
             tokens_issued_yocto = await ft_total_supply(pool_name)
             tokens_issued = Decimal(tokens_issued_yocto)/Decimal(1e24)
 
-            print("--", tokens_issued_yocto)
             # Step 5: Calculate Value per Token (VPT)
             if int(tokens_issued_yocto) == 0:
                 # First deposit scenario: set initial VPT
@@ -200,16 +288,17 @@ async def process_job(job):
 
             # Convert tokens_to_issue to yocto units for NEP-141 compliance
             tokens_to_issue_yocto = tokens_to_issue * Decimal(1e24)
-            print("!!", tokens_to_issue_yocto, usdc_received, value_per_token, pool_total_value_before, tokens_issued)
+            logger.debug("Deposit {}: issuing {} yocto for {} USDC at VPT {} (pool value {}, supply {})",
+                         job_id, tokens_to_issue_yocto, usdc_received, value_per_token, pool_total_value_before, tokens_issued)
 
             # Step 7: Add net deposit amount to pool holdings
-            pool_api.add_pool_holdings(pool_name, "USDC", decimal_to_str(usdc_received, "0.01"))
+            await pool_api.add_pool_holdings(pool_name, "USDC", decimal_to_str(usdc_received, "0.01"))
 
             # Step 8: Fulfill deposit with calculated tokens in yocto units
             await fulfill_deposit(tokens_to_issue_yocto, details, pool_name, owner_account_id, private_key)
 
             # Step 9: Record the DEPOSIT action in the pool’s history
-            pool_api.record_action(
+            await pool_api.record_action(
                 pool_name,
                 "DEPOSIT",
                 account_id,
@@ -222,7 +311,7 @@ async def process_job(job):
                 }
             )
 
-            print(f"Deposit processed: {job_id} {details}")
+            logger.info("Deposit processed: {} {}", job_id, summarize(details))
 
         elif action == 'fulfillWithdraw':
             account_id = details["iou"]["account_id"]
@@ -231,31 +320,31 @@ async def process_job(job):
             tokens = tokens_yocto / Decimal(1e24)  # Convert yocto tokens to standard units
 
             # Step 1: Get total token supply in standard units
-            total_tokens_yocto = await ft_total_supply(pool_name)
+            # (read after the job arrived, since the withdraw request burned tokens outside the oracle)
+            total_tokens_yocto = await ft_total_supply(pool_name, newer_than=job_received_at(job))
             total_tokens = Decimal(total_tokens_yocto) / Decimal(1e24)
 
             # Step 2: Calculate the percentage of the pool the user owns
             percentage_pool = tokens / (total_tokens+tokens)
 
             # Step 3: Get the current pool holdings and total USDC value
-            pool = pool_api.get_pool(pool_name)
-            market_prices = pool_api.get_market_prices(pool)
-            portfolio_total_usdc = calculate_usdc_total_from_holdings(pool["holdings"], market_prices, "bid")
+            pool = await pool_api.get_pool(pool_name)
+            market_prices = (await price_cache.get(pool)).require_fresh()
+            # Parse holdings and prices once for both the valuation and the rebalance
+            with metrics.stage_seconds.time(stage="valuation"):
+                valuation = PortfolioValuation(pool["holdings"], market_prices)
+                portfolio_total_usdc = valuation.nav()
 
-            print("-- found tokens:", tokens, "total tokens:", total_tokens)
-            print("-- percentage of pool to withdraw:", percentage_pool)
+            logger.debug("Withdraw {}: {} of {} tokens ({} of the pool)", job_id, tokens, total_tokens, percentage_pool)
 
             # Step 4: Rebalance the portfolio to get the required USDC
             # (Assuming rebalance_portfolio returns the USDC amount equivalent to the percentage of the pool)
-            print("This user is getting", percentage_pool)
-            new_holdings, usdc_received = rebalance_portfolio(pool["holdings"], percentage_pool, portfolio_total_usdc, market_prices)
-            print("new holdings", new_holdings)
-            print("usdc_received", usdc_received)
-
-            print('pool updated')
+            with metrics.stage_seconds.time(stage="rebalance"):
+                new_holdings, usdc_received = valuation.rebalance(percentage_pool, portfolio_total_usdc)
+            logger.debug("Rebalanced holdings: {}", summarize(new_holdings))
 
             # Record the REBALANCE action
-            pool_api.record_action(
+            await pool_api.record_action(
                 pool_name,
                 "REBALANCE",
                 "Platform",
@@ -265,15 +354,16 @@ async def process_job(job):
                 }
             )
 
-            print("USDC received after rebalancing:", usdc_received)
+            logger.info("USDC received after rebalancing: {}", usdc_received)
 
             # Step 5: Swap USDC to NEAR
-            near_received, fees = await swap_usdc_to_near(usdc_received, pool_name, owner_account_id, private_key)
+            with metrics.stage_seconds.time(stage="swap usdc_to_near"):
+                near_received, fees = await swap_usdc_to_near(usdc_received, pool_name, owner_account_id, private_key)
             new_holdings["USDC"]["amount"] = decimal_to_str(Decimal(new_holdings["USDC"]["amount"]) - usdc_received)
-            pool_api.update_pool(pool_name, new_holdings)
+            await pool_api.update_pool(pool_name, new_holdings)
 
             # Record the SWAP action
-            pool_api.record_action(
+            await pool_api.record_action(
                 pool_name,
                 "SWAP",
                 "Platform",
@@ -286,7 +376,7 @@ async def process_job(job):
                 }
             )
 
-            print("NEAR received from swap:", near_received)
+            logger.info("NEAR received from swap: {}", near_received)
 
             # Step 6: Deduct the 2% operational fee
             operational_fee = near_received * Decimal("0.02")
@@ -299,7 +389,7 @@ async def process_job(job):
             await fulfill_withdraw(near_received_minus_fee_quantized, details, pool_name, owner_account_id, private_key)
 
             # Record the WITHDRAW action
-            pool_api.record_action(
+            await pool_api.record_action(
                 pool_name,
                 "WITHDRAW",
                 account_id,
@@ -312,31 +402,191 @@ async def process_job(job):
                 }
             )
 
-            print(f"Withdraw processed: {job_id} {details}")
+            logger.info("Withdraw processed: {} {}", job_id, summarize(details))
         else:
             details = {"error": f"Unknown action: {action}"}
-            print(f"Unknown action: {action}")
+            logger.warning("Unknown action: {}", action)
 
         # Update job status to 'complete' with details
-        update_job_status(job_id, 'complete', details)
+        await update_job_status(job_id, 'complete', details)
     
     except Exception as e:
         error_details = {
             "error": str(e),
             "stack_trace": traceback.format_exc()
         }
-        print(f"Failed to process job {job_id}: {error_details}")
+        logger.error("Failed to process job {}: {}\n{}", job_id, error_details["error"], error_details["stack_trace"])
+        metrics.job_failures.inc(action=action)
 
         # Update job status to 'failed' with error details
-        update_job_status(job_id, 'failed', error_details)
+        await update_job_status(job_id, 'failed', error_details)
+
+async def process_fulfill_batch(pool_name, jobs):
+    """
+    Fulfills several queued fulfillDeposit/fulfillWithdraw jobs for one pool together.
+
+    All IOUs are priced from one value-per-token snapshot, deposits are
+    netted against withdrawals, and a single swap (plus a single rebalance
+    if the batch is a net outflow) covers the difference. Each IOU is still
+    fulfilled on-chain with its own amount and its job gets its own status.
+    """
+    for job in jobs:
+        observe_pickup(job)
+    with metrics.job_seconds.time(action="fulfillBatch"):
+        await _process_fulfill_batch(pool_name, jobs)
+
+async def _process_fulfill_batch(pool_name, jobs):
+    owner_account_id = "itchy-harmony.testnet"
+    private_key = os.getenv("OWNER_PRIVATE_KEY", None)
+
+    if private_key is None:
+        logger.error("MUST SET OWNER_PRIVATE_KEY!!")
+        return
+
+    deposit_jobs = [job for job in jobs if job['action'] == 'fulfillDeposit']
+    withdraw_jobs = [job for job in jobs if job['action'] == 'fulfillWithdraw']
+    logger.info("Batch for {}: {} deposits, {} withdraws", pool_name, len(deposit_jobs), len(withdraw_jobs))
+
+    try:
+        # Step 1: Snapshot pool value and token supply
+        pool = await pool_api.get_pool(pool_name)
+        market_prices = (await price_cache.get(pool)).require_fresh()
+        valuation = PortfolioValuation(pool["holdings"], market_prices)
+        pool_total_value = valuation.nav()
+        # Read after the withdraw jobs arrived, since their requests burned tokens outside the oracle
+        total_supply_yocto = await ft_total_supply(pool_name, newer_than=max(map(job_received_at, withdraw_jobs), default=None))
+
+        # Step 2: Price every IOU from the same VPT and net the flows
+        plan = plan_pool_flows(
+            [job['details']['iou']['amount'] for job in deposit_jobs],
+            [job['details']['iou']['amount'] for job in withdraw_jobs],
+            pool_total_value,
+            total_supply_yocto,
+            USD_CONVERSION_RATE,
+        )
+        net_usdc = plan["net_usdc"]
+        logger.info("Batch for {}: VPT {}, net USDC {}", pool_name, plan["value_per_token"], net_usdc)
+
+        # Step 3: One swap for the net amount
+        if net_usdc > 0:
+            near_to_swap = (net_usdc / USD_CONVERSION_RATE * Decimal("1e24")).quantize(Decimal("1"), rounding=ROUND_DOWN)
+            usdc_received, fees = await swap_near_to_usdc(near_to_swap, pool_name, owner_account_id, private_key)
+            await pool_api.add_pool_holdings(pool_name, "USDC", decimal_to_str(usdc_received, "0.01"))
+            await pool_api.record_action(
+                pool_name,
+                "SWAP",
+                "Platform",
+                details={
+                    "from_asset": "NEAR",
+                    "to_asset": "USDC",
+                    "amount": decimal_to_str(near_to_swap),
+                    "result_amount": decimal_to_str(usdc_received, "0.01"),
+                    "fees": decimal_to_str(fees)
+                }
+            )
+        elif net_usdc < 0:
+            usdc_needed = -net_usdc
+            new_holdings, usdc_raised = valuation.rebalance(usdc_needed / pool_total_value, pool_total_value)
+            await pool_api.record_action(
+                pool_name,
+                "REBALANCE",
+                "Platform",
+                details={
+                    "result_amount": decimal_to_str(usdc_raised, "0.01"),
+                    "fees": "0"
+                }
+            )
+            near_received, fees = await swap_usdc_to_near(usdc_raised, pool_name, owner_account_id, private_key)
+            new_holdings["USDC"]["amount"] = decimal_to_str(Decimal(new_holdings["USDC"]["amount"]) - usdc_raised)
+            await pool_api.update_pool(pool_name, new_holdings)
+            await pool_api.record_action(
+                pool_name,
+                "SWAP",
+                "Platform",
+                details={
+                    "from_asset": "USDC",
+                    "to_asset": "NEAR",
+                    "amount": decimal_to_str(usdc_raised, "0.01"),
+                    "result_amount": decimal_to_str(near_received),
+                    "fees": decimal_to_str(fees)
+                }
+            )
+    except Exception as e:
+        error_details = {
+            "error": str(e),
+            "stack_trace": traceback.format_exc()
+        }
+        logger.error("Failed to process batch for {}: {}\n{}", pool_name, error_details["error"], error_details["stack_trace"])
+        for job in jobs:
+            metrics.job_failures.inc(action=job['action'])
+            await update_job_status(job['id'], 'failed', error_details)
+        return
+
+    # Step 4: Fulfill each IOU with its own amount, several per transaction
+    fulfillments = [("fulfill_deposit_iou", deposit["tokens_yocto"], job['details']) for job, deposit in zip(deposit_jobs, plan["deposits"])]
+    fulfillments += [("fulfill_withdraw_iou", withdraw["near_payout"], job['details']) for job, withdraw in zip(withdraw_jobs, plan["withdraws"])]
+    results = await fulfill_ious_batch(fulfillments, pool_name, owner_account_id, private_key)
+
+    for job, entry, result in zip(deposit_jobs + withdraw_jobs, plan["deposits"] + plan["withdraws"], results):
+        details = job['details']
+        if not result["success"]:
+            metrics.job_failures.inc(action=job['action'])
+            await update_job_status(job['id'], 'failed', {"error": result["error"]})
+            continue
+        if job['action'] == 'fulfillDeposit':
+            await pool_api.record_action(
+                pool_name,
+                "DEPOSIT",
+                details["iou"]["account_id"],
+                details={
+                    "from_asset": "NEAR",
+                    "to_asset": "USDC",
+                    "amount": decimal_to_str(entry["usdc"], "0.01"),
+                    "result_tokens": decimal_to_str(entry["tokens"]),
+                    "fees": decimal_to_str(entry["operational_fee"])
+                }
+            )
+        else:
+            await pool_api.record_action(
+                pool_name,
+                "WITHDRAW",
+                details["iou"]["account_id"],
+                details={
+                    "from_asset": "USDC",
+                    "to_asset": "NEAR",
+                    "amount": decimal_to_str(entry["usdc"], "0.01"),
+                    "result_amount": decimal_to_str(entry["near_payout"]),
+                    "fees": decimal_to_str(entry["operational_fee"])
+                }
+            )
+        await update_job_status(job['id'], 'complete', details)
 
 async def run_job_processor():
-    """Runs the job processor, polling for jobs every 10 seconds."""
+    """Runs the job processor, waking as soon as new jobs are queued.
+
+    Jobs for different pools run concurrently (up to JOB_CONCURRENCY at once);
+    jobs for the same pool run one at a time in job id order. With
+    NET_POOL_FLOWS=1, consecutive deposit and withdraw jobs queued for the
+    same pool are fulfilled together by process_fulfill_batch.
+    """
+    if ORACLE_RECORD:
+        replay.install_recorder(sys.modules[__name__], ORACLE_RECORD)
+    if NET_POOL_FLOWS:
+        scheduler = PoolJobScheduler(process_job, batch_handler=process_fulfill_batch, batch_actions=('fulfillDeposit', 'fulfillWithdraw'))
+    else:
+        scheduler = PoolJobScheduler(process_job)
+    feed = JobFeed(pool_api)
+    await metrics.start_metrics_server()
     while True:
-        jobs = fetch_jobs()
-        for job in jobs:
-            await process_job(job)  # Sequentially process each job
-        await asyncio.sleep(10)  # Poll every 10 seconds
+        jobs = await feed.next_jobs()  # Long-polls the Pool API, or polls adaptively as a fallback
+        logger.bind(sample=20).debug("{} pending jobs, {} queued or running", len(jobs), scheduler.pending())
+        for job in sorted(jobs, key=lambda job: job['id']):
+            if job['id'] in unsent_job_statuses:
+                # Already ran; only its status update is missing
+                await update_job_status(job['id'], *unsent_job_statuses[job['id']])
+                continue
+            mark_received(job)
+            scheduler.submit(job)  # Skips jobs that are still queued or running
 
 if __name__ == "__main__":
     asyncio.run(run_job_processor())
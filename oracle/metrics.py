@@ -0,0 +1,129 @@
+import os
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from log import logger
+
+# Port for the Prometheus text endpoint (0 disables it); only bound on localhost
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self, kind):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {kind}"]
+
+class Counter(Metric):
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header("counter")
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Gauge(Metric):
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def render(self):
+        lines = self.header("gauge")
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram(Metric):
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry["counts"][i] += 1
+        entry["sum"] += value
+        entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = self.header("histogram")
+        for key, entry in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, entry["counts"]):
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {entry['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {entry['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {entry['count']}")
+        return lines
+
+job_seconds = Histogram("oracle_job_seconds", "Time to process a job, by action.", ["action"])
+job_failures = Counter("oracle_job_failures_total", "Jobs that ended in failure, by action.", ["action"])
+job_age_seconds = Histogram("oracle_job_age_seconds", "Time from job creation to pickup, by action.", ["action"])
+stage_seconds = Histogram("oracle_stage_seconds", "Time spent in one stage of a job (Pool API call, RPC call, valuation, swap).", ["stage"])
+stage_failures = Counter("oracle_stage_failures_total", "Stage calls that failed after all retries.", ["stage"])
+retries = Counter("oracle_retries_total", "Retried attempts of RPC calls.", ["stage"])
+queue_depth = Gauge("oracle_queue_depth", "Jobs queued or running in the scheduler.")
+
+ALL_METRICS = [job_seconds, job_failures, job_age_seconds, stage_seconds, stage_failures, retries, queue_depth]
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def start_metrics_server(port=METRICS_PORT):
+    """
+    Serves /metrics on localhost. Returns the runner, or None when disabled
+    or when the port cannot be bound (metrics are optional; jobs go on).
+    """
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+    except OSError as e:
+        logger.error("Cannot serve metrics on port {}, continuing without them: {}", port, e)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics available at http://127.0.0.1:{}/metrics", port)
+    return runner
@@ -0,0 +1,134 @@
+import asyncio
+import os
+
+import base58
+from py_near import transactions
+from py_near.account import Account
+from py_near.exceptions.provider import InvalidNonce, InvalidTxError
+
+# Overrides the public RPC endpoint for every network (e.g. a private node or a local stand-in)
+NEAR_RPC_URL = os.getenv("NEAR_RPC_URL", "")
+
+def rpc_url(network):
+    return NEAR_RPC_URL or f"https://rpc.{network}.near.org"
+
+class TransactionOutcomeUnknown(Exception):
+    """A transaction may have executed, but it cannot be found and resending it is no longer safe."""
+
+class CachedAccount(Account):
+    """
+    py_near Account that tracks access-key nonces locally.
+
+    The stock Account looks up the access key before every transaction to
+    find the next nonce. Here the nonce is fetched once per key and then
+    incremented in memory under a lock, so back-to-back function calls skip
+    that round trip and never sign two transactions with the same nonce.
+    The cached nonce is dropped on InvalidNonce so the next attempt resyncs.
+
+    A transaction that fails after it was sent (RPC timeout, dropped
+    connection) may still execute. Its error gets a `resend` coroutine
+    function that retries must use instead of signing a new transaction:
+    it looks the transaction up by hash and otherwise sends the same signed
+    bytes again, so it executes at most once.
+    """
+    def __init__(self, account_id=None, private_key=None, rpc_addr=None):
+        super().__init__(account_id, private_key, rpc_addr=rpc_addr)
+        self._nonces = {}
+        self._nonce_lock = asyncio.Lock()
+        self._signer_index = 0
+
+    async def _next_nonce(self, pk):
+        async with self._nonce_lock:
+            if pk not in self._nonces:
+                access_key = await self.get_access_key(pk)
+                self._nonces[pk] = access_key.nonce
+            self._nonces[pk] += 1
+            return self._nonces[pk]
+
+    def reset_nonce(self, pk=None):
+        if pk is None:
+            self._nonces.clear()
+        else:
+            self._nonces.pop(pk, None)
+
+    async def sign_and_submit_tx(self, receiver_id, actions, nowait=False, included=False):
+        if not self._signers:
+            raise ValueError("You must provide a private key or seed to call methods")
+        await self._update_last_block_hash()
+
+        # Spread transactions across keys round-robin
+        pk = self._signers[self._signer_index % len(self._signers)]
+        self._signer_index += 1
+        nonce = await self._next_nonce(pk)
+
+        block_hash = base58.b58decode(self._latest_block_hash.encode("utf8"))
+        trx_hash = transactions.calc_trx_hash(self.account_id, pk, receiver_id, nonce, actions, block_hash)
+        serialized_tx = transactions.sign_and_serialize_transaction(
+            self.account_id, pk, receiver_id, nonce, actions, block_hash
+        )
+        try:
+            if included or nowait:
+                await self._provider.send_tx_included(serialized_tx)
+                return trx_hash
+            return await self._provider.send_tx_and_wait(serialized_tx, trx_hash=trx_hash, receiver_id=receiver_id)
+        except InvalidNonce:
+            self.reset_nonce(pk)
+            raise
+        except InvalidTxError:
+            # Rejected before execution (including Expired): signing a new transaction is safe
+            raise
+        except Exception as e:
+            self._mark_unknown(e, serialized_tx, trx_hash, receiver_id)
+            raise
+
+    def _mark_unknown(self, error, serialized_tx, trx_hash, receiver_id):
+        error.trx_hash = trx_hash
+        error.resend = lambda: self._resend(serialized_tx, trx_hash, receiver_id)
+
+    async def _find_tx(self, trx_hash):
+        """The transaction's result, or None if the node does not know it (yet)."""
+        try:
+            return await self._provider.get_tx(trx_hash, self.account_id)
+        except Exception:
+            return None
+
+    async def _resend(self, serialized_tx, trx_hash, receiver_id):
+        """Returns the result of a transaction whose outcome was unknown, sending the same signed bytes if it has not landed."""
+        result = await self._find_tx(trx_hash)
+        if result is not None:
+            return result
+        try:
+            return await self._provider.send_tx_and_wait(serialized_tx, trx_hash=trx_hash, receiver_id=receiver_id)
+        except InvalidNonce:
+            # The nonce is taken, most likely by this very transaction landing in the meantime
+            result = await self._find_tx(trx_hash)
+            if result is not None:
+                return result
+            raise TransactionOutcomeUnknown(f"Nonce of transaction {trx_hash} was used, but the transaction cannot be found")
+        except InvalidTxError:
+            raise
+        except Exception as e:
+            self._mark_unknown(e, serialized_tx, trx_hash, receiver_id)
+            raise
+
+# Process-wide registry of warm accounts keyed by (account_id, network)
+_accounts = {}
+
+def get_account(account_id=None, private_key=None, network="testnet"):
+    """
+    Returns the shared account for (account_id, network), creating it on first use.
+    Pass no account_id for a read-only account used for view calls.
+    """
+    key = (account_id, network)
+    account = _accounts.get(key)
+    if account is None:
+        account = CachedAccount(account_id, private_key, rpc_addr=rpc_url(network))
+        _accounts[key] = account
+    return account
+
+async def close_accounts():
+    """Closes the RPC connections of every cached account."""
+    for account in _accounts.values():
+        if account.provider._client is not None:
+            await account.provider.shutdown()
+    _accounts.clear()
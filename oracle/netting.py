@@ -0,0 +1,76 @@
+from decimal import Decimal, ROUND_DOWN
+
+# Same yocto conversion and fees as the single-job deposit/withdraw handlers in main.py
+YOCTO = Decimal(1e24)
+DEPOSIT_FEE = Decimal('0.01')
+WITHDRAW_FEE = Decimal('0.02')
+
+def plan_pool_flows(deposit_amounts, withdraw_amounts, pool_total_value, total_supply_yocto, usd_conversion_rate):
+    """
+    Prices a batch of deposit and withdraw IOUs for one pool from a single
+    value-per-token (VPT) snapshot and nets them against each other.
+
+    Parameters:
+    - deposit_amounts: NEAR amount (yocto) of each deposit IOU.
+    - withdraw_amounts: pool token amount (yocto) of each withdraw IOU.
+    - pool_total_value: pool value in USDC before the batch.
+    - total_supply_yocto: current token supply. Withdraw IOUs have already
+      burned their tokens, so they are added back to get the supply the
+      pool value is shared between.
+    - usd_conversion_rate: USDC per NEAR.
+
+    Returns a dict with:
+    - value_per_token
+    - deposits: per deposit {operational_fee, near_after_fee, usdc, tokens, tokens_yocto}
+    - withdraws: per withdraw {tokens, percentage_pool, usdc, near, operational_fee, near_payout}
+    - net_usdc: deposit USDC minus withdraw USDC. Positive means NEAR has
+      to be swapped into USDC, negative means USDC has to be raised and
+      swapped into NEAR.
+    """
+    pool_total_value = Decimal(pool_total_value)
+    withdraw_tokens = [Decimal(amount) / YOCTO for amount in withdraw_amounts]
+    supply_before = Decimal(total_supply_yocto) / YOCTO + sum(withdraw_tokens, Decimal(0))
+
+    if supply_before == 0:
+        # First deposit scenario: set initial VPT
+        value_per_token = Decimal('1')
+    else:
+        value_per_token = pool_total_value / supply_before
+
+    deposits = []
+    for near_amount in deposit_amounts:
+        near_amount = Decimal(near_amount)
+        operational_fee = near_amount * DEPOSIT_FEE
+        near_after_fee = near_amount - operational_fee
+        usdc = near_after_fee * usd_conversion_rate / YOCTO
+        tokens = usdc / value_per_token
+        deposits.append({
+            "operational_fee": operational_fee,
+            "near_after_fee": near_after_fee,
+            "usdc": usdc,
+            "tokens": tokens,
+            "tokens_yocto": tokens * YOCTO,
+        })
+
+    withdraws = []
+    for tokens in withdraw_tokens:
+        percentage_pool = tokens / supply_before
+        usdc = percentage_pool * pool_total_value
+        near = ((usdc / usd_conversion_rate) * Decimal("1e24")).quantize(Decimal("1"), rounding=ROUND_DOWN)
+        operational_fee = near * WITHDRAW_FEE
+        withdraws.append({
+            "tokens": tokens,
+            "percentage_pool": percentage_pool,
+            "usdc": usdc,
+            "near": near,
+            "operational_fee": operational_fee,
+            "near_payout": (near - operational_fee).quantize(Decimal("1"), rounding=ROUND_DOWN),
+        })
+
+    net_usdc = sum((d["usdc"] for d in deposits), Decimal(0)) - sum((w["usdc"] for w in withdraws), Decimal(0))
+    return {
+        "value_per_token": value_per_token,
+        "deposits": deposits,
+        "withdraws": withdraws,
+        "net_usdc": net_usdc,
+    }
@@ -0,0 +1,113 @@
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from itertools import accumulate
+
+class BookSide:
+    """
+    One side of an order book, best price first, with cumulative size and
+    cost arrays so fills are priced with a binary search instead of walking
+    the levels.
+
+    A side built from a bare top-of-book price (no depth known) has a single
+    level of unlimited size, which prices every fill at that price.
+    """
+    def __init__(self, levels, descending, unlimited=False):
+        levels = sorted(((Decimal(price), Decimal(size)) for price, size in levels), reverse=descending)
+        levels = [(price, size) for price, size in levels if size > 0 or unlimited]
+        self.descending = descending
+        self.unlimited = unlimited
+        self.prices = [price for price, _ in levels]
+        # Ascending keys for bisecting by price limit
+        self.keys = [-price for price in self.prices] if descending else self.prices
+        self.cumulative_sizes = list(accumulate(size for _, size in levels))
+        self.cumulative_costs = list(accumulate(price * size for price, size in levels))
+
+    def best(self):
+        return self.prices[0] if self.prices else None
+
+    def _levels(self, limit):
+        """Number of levels priced at or better than limit."""
+        if limit is None:
+            return len(self.prices)
+        return bisect_right(self.keys, -Decimal(limit) if self.descending else Decimal(limit))
+
+    def _cost(self, amount):
+        """Cost of taking amount (at most the available size) from the best levels."""
+        if self.unlimited:
+            return amount * self.prices[0]
+        level = bisect_left(self.cumulative_sizes, amount)
+        size_before = self.cumulative_sizes[level - 1] if level else 0
+        cost_before = self.cumulative_costs[level - 1] if level else 0
+        return cost_before + (amount - size_before) * self.prices[level]
+
+    def available(self, limit=None):
+        """Size that can be taken at prices no worse than limit (None if unlimited)."""
+        levels = self._levels(limit)
+        if self.unlimited and levels:
+            return None
+        return self.cumulative_sizes[levels - 1] if levels else Decimal(0)
+
+    def fill(self, amount, limit=None):
+        """
+        Takes up to amount at prices no worse than limit.
+
+        Returns (volume-weighted average price, filled size); the price is
+        None if nothing can be filled.
+        """
+        amount = Decimal(amount)
+        available = self.available(limit)
+        if amount <= 0 or available == 0:
+            return None, Decimal(0)
+        if available is not None and amount > available:
+            amount = available
+        return self._cost(amount) / amount, amount
+
+    def average_price(self, amount):
+        """
+        Volume-weighted price of taking all of amount, pricing any part
+        beyond the book at its worst level. None if the side is empty.
+        """
+        amount = Decimal(amount)
+        if not self.prices:
+            return None
+        if amount <= 0:
+            return self.prices[0]
+        price, filled = self.fill(amount)
+        if filled == amount:
+            return price
+        return (price * filled + (amount - filled) * self.prices[-1]) / amount
+
+class OrderBook:
+    """Bid and ask depth for one market; buys take the asks and sells take the bids."""
+    def __init__(self, bids, asks):
+        self.bids = bids
+        self.asks = asks
+
+    @classmethod
+    def from_prices(cls, prices):
+        """
+        Builds the book from one /api/market_prices entry: the "bids" and
+        "asks" levels ({"price", "size"}) when present, else the top-of-book
+        "bid" and "ask" with unlimited size.
+        """
+        sides = []
+        for levels_key, best_key, descending in (("bids", "bid", True), ("asks", "ask", False)):
+            levels = prices.get(levels_key)
+            if levels is not None:
+                sides.append(BookSide([(level["price"], level["size"]) for level in levels], descending))
+            elif prices.get(best_key) is not None:
+                sides.append(BookSide([(prices[best_key], 0)], descending, unlimited=True))
+            else:
+                sides.append(BookSide([], descending))
+        return cls(*sides)
+
+    def has_depth(self):
+        return not (self.bids.unlimited or self.asks.unlimited)
+
+    def buy(self, amount, limit=None):
+        """(average price, filled size) for buying up to amount shares."""
+        return self.asks.fill(amount, limit)
+
+    def sell(self, amount, limit=None):
+        """(average price, filled size) for selling up to amount shares."""
+        return self.bids.fill(amount, limit)
@@ -1,50 +1,121 @@
-import requests
-import re
+import asyncio
+import os
+import threading
+import aiohttp
+import metrics
+from log import logger
 from urllib.parse import urlparse, parse_qs
 
+# Per-request timeout (seconds) for calls to the Pool API
+POOL_API_TIMEOUT = float(os.getenv("POOL_API_TIMEOUT", "10"))
+# Size of the shared keep-alive connection pool
+POOL_API_MAX_CONNECTIONS = int(os.getenv("POOL_API_MAX_CONNECTIONS", "20"))
+
 def parse_event_url(url):
     # Parse the URL
     parsed_url = urlparse(url)
-    
+
     # Extract the event_name from the path (everything after '/event/')
     event_name = parsed_url.path.split('/event/')[-1]
-    
+
     # Extract the `tid` from query parameters
     query_params = parse_qs(parsed_url.query)
     tid = query_params.get('tid', [None])[0]
-    
+
     return [event_name, tid]
 
-class PoolApiClient:
-    def __init__(self, base_url):
+class AsyncPoolApiClient:
+    """
+    Async Pool API client. All requests share one aiohttp session, so
+    connections are kept alive and reused between calls instead of paying a
+    new TCP/TLS handshake per request.
+    """
+    def __init__(self, base_url, timeout=POOL_API_TIMEOUT, max_connections=POOL_API_MAX_CONNECTIONS):
         self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self._session = None
 
-    def fetch_jobs(self):
+    def _get_session(self):
+        # The session is bound to the running event loop, so create it lazily
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    async def _read_json(response):
+        """The response body as JSON; a body that is not JSON (e.g. an HTML error page) raises a ClientError."""
+        try:
+            return await response.json(content_type=None)
+        except ValueError as e:
+            raise aiohttp.ClientPayloadError(f"Invalid JSON from {response.url}: {e}") from e
+
+    async def _request(self, method, path, params=None, json=None, read_json=True):
+        """
+        Sends a request and returns its JSON body. Pass read_json=False when
+        the body is not used, so any 2xx response counts as success.
+        """
+        session = self._get_session()
+        stage = f"pool_api {method} {path}"
+        try:
+            with metrics.stage_seconds.time(stage=stage):
+                async with session.request(method, f"{self.base_url}{path}", params=params, json=json) as response:
+                    response.raise_for_status()
+                    return await self._read_json(response) if read_json else None
+        except Exception:
+            metrics.stage_failures.inc(stage=stage)
+            raise
+
+    async def fetch_jobs(self):
         """Fetches pending jobs from the /api/jobs endpoint."""
         try:
-            response = requests.get(f"{self.base_url}/api/jobs")
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error fetching jobs: {e}")
+            # An empty body counts as no jobs
+            return await self._request("GET", "/api/jobs") or []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error fetching jobs: {}", e)
             return []
 
-    def update_job_status(self, job_id, status, details=None):
-        """Updates the job status via the /api/jobs endpoint."""
+    async def wait_for_jobs(self, after_id, wait):
+        """
+        Long-polls /api/jobs until a job newer than after_id is pending or
+        `wait` seconds pass. Returns all pending jobs, or None if the request failed.
+        """
+        timeout = aiohttp.ClientTimeout(total=wait + self.timeout.total)
+        try:
+            session = self._get_session()
+            async with session.get(f"{self.base_url}/api/jobs", params={"wait": wait, "after": after_id}, timeout=timeout) as response:
+                response.raise_for_status()
+                jobs = await self._read_json(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error waiting for jobs: {}", e)
+            return None
+        if not isinstance(jobs, list):
+            logger.error("Error waiting for jobs: expected a list, got {}", type(jobs).__name__)
+            return None
+        return jobs
+
+    async def update_job_status(self, job_id, status, details=None):
+        """Updates the job status via the /api/jobs endpoint. Returns False if the update failed."""
         payload = {
             "jobId": job_id,
             "status": status,
             "details": details,
         }
         try:
-            response = requests.post(f"{self.base_url}/api/jobs", json=payload)
-            response.raise_for_status()
-            print(f"Job {job_id} status updated to {status}")
-        except requests.RequestException as e:
-            print(f"Failed to update job status for job {job_id}: {e}")
+            await self._request("POST", "/api/jobs", json=payload, read_json=False)
+            logger.debug("Job {} status updated to {}", job_id, status)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to update job status for job {}: {}", job_id, e)
+            return False
 
-
-    def record_action(self, pool_name, action, by, details=None):
+    async def record_action(self, pool_name, action, by, details=None):
         """Records an action with pool details."""
         payload = {
             "action": action,
@@ -53,20 +124,18 @@ class PoolApiClient:
             "poolName": pool_name
         }
         try:
-            response = requests.post(f"{self.base_url}/api/actions", json=payload)
-            response.raise_for_status()
-            print(f"Action recorded: {action} by {by}")
-        except requests.RequestException as e:
-            print(f"Failed to record action {action}: {e}")
+            await self._request("POST", "/api/actions", json=payload, read_json=False)
+            logger.debug("Action recorded: {} by {}", action, by)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to record action {}: {}", action, e)
 
-    def get_pool(self, pool_name):
+    async def get_pool(self, pool_name):
         try:
-            response = requests.get(f"{self.base_url}/api/pool", params={"name": pool_name})
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Failed to retrieve pool '{pool_name}': {e}")
+            return await self._request("GET", "/api/pool", params={"name": pool_name})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to retrieve pool '{}': {}", pool_name, e)
 
-    def add_pool_holdings(self, pool_name, asset_name, amount, cost_basis="0"):
+    async def add_pool_holdings(self, pool_name, asset_name, amount, cost_basis="0"):
         """Updates pool holdings by adding to the specified asset amount."""
         payload = {
             "poolName": pool_name,
@@ -75,32 +144,107 @@ class PoolApiClient:
             "costBasis": cost_basis
         }
         try:
-            response = requests.post(f"{self.base_url}/api/add_pool_holdings", json=payload)
-            response.raise_for_status()
-            print(f"Holdings updated: {asset_name} increased by {amount} in {pool_name}")
-        except requests.RequestException as e:
-            print(f"Failed to update holdings for {asset_name}: {e}")
+            await self._request("POST", "/api/add_pool_holdings", json=payload, read_json=False)
+            logger.debug("Holdings updated: {} increased by {} in {}", asset_name, amount, pool_name)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to update holdings for {}: {}", asset_name, e)
 
-    def update_pool(self, pool_name, new_holdings):
+    async def apply_pool_changes(self, pool_name, changes, action, by, details=None):
+        """
+        Applies holding changes and records an action in one request and one
+        database transaction. `changes` is a list of (asset_name, amount) or
+        (asset_name, amount, cost_basis) tuples. Returns False if nothing was applied.
+        """
+        payload = {
+            "poolName": pool_name,
+            "changes": [
+                {"assetName": change[0], "amount": change[1], "costBasis": change[2] if len(change) > 2 else "0"}
+                for change in changes
+            ],
+            "action": {"action": action, "by": by, "details": details or {}},
+        }
         try:
-            response = requests.post(
-                f"{self.base_url}/api/pool",
-                params={"name": pool_name},
-                json={"holdings": new_holdings}
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Failed to update pool '{pool_name}': {e}")
+            await self._request("POST", "/api/apply_pool_changes", json=payload, read_json=False)
+            logger.debug("Pool changes applied: {} by {} ({} holdings) in {}", action, by, len(changes), pool_name)
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to apply pool changes for {}: {}", action, e)
+            return False
 
-    def get_market_prices(self, pool):
-        """Fetches pending jobs from the /api/jobs endpoint."""
+    async def update_pool(self, pool_name, new_holdings):
+        try:
+            return await self._request("POST", "/api/pool", params={"name": pool_name}, json={"holdings": new_holdings})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to update pool '{}': {}", pool_name, e)
+
+    async def get_market_prices(self, pool):
+        """Fetches bid/ask prices for the pool's market from the /api/market_prices endpoint."""
         try:
             event_name, tid = parse_event_url(pool["markets"][0])
-            response = requests.get(f"{self.base_url}/api/market_prices?event_name={event_name}&tid={tid}")
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error fetching jobs: {e}")
+            params = {"event_name": event_name}
+            if tid is not None:
+                params["tid"] = tid
+            return await self._request("GET", "/api/market_prices", params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Error fetching market prices: {}", e)
             return []
 
+class PoolApiClient:
+    """
+    Blocking wrapper around AsyncPoolApiClient for callers outside of asyncio.
+
+    Requests run on a private event loop in a background thread, so they
+    share the async client's connection pool.
+    """
+    def __init__(self, base_url, timeout=POOL_API_TIMEOUT, max_connections=POOL_API_MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.client = AsyncPoolApiClient(base_url, timeout, max_connections)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        if self._loop is not None:
+            self._run(self.client.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    def fetch_jobs(self):
+        """Fetches pending jobs from the /api/jobs endpoint."""
+        return self._run(self.client.fetch_jobs())
+
+    def wait_for_jobs(self, after_id, wait):
+        """Long-polls /api/jobs until a job newer than after_id is pending or `wait` seconds pass."""
+        return self._run(self.client.wait_for_jobs(after_id, wait))
+
+    def update_job_status(self, job_id, status, details=None):
+        """Updates the job status via the /api/jobs endpoint. Returns False if the update failed."""
+        return self._run(self.client.update_job_status(job_id, status, details))
+
+    def record_action(self, pool_name, action, by, details=None):
+        """Records an action with pool details."""
+        return self._run(self.client.record_action(pool_name, action, by, details))
+
+    def get_pool(self, pool_name):
+        return self._run(self.client.get_pool(pool_name))
+
+    def add_pool_holdings(self, pool_name, asset_name, amount, cost_basis="0"):
+        """Updates pool holdings by adding to the specified asset amount."""
+        return self._run(self.client.add_pool_holdings(pool_name, asset_name, amount, cost_basis))
+
+    def apply_pool_changes(self, pool_name, changes, action, by, details=None):
+        """Applies holding changes and records an action in one request and one database transaction."""
+        return self._run(self.client.apply_pool_changes(pool_name, changes, action, by, details))
+
+    def update_pool(self, pool_name, new_holdings):
+        return self._run(self.client.update_pool(pool_name, new_holdings))
+
+    def get_market_prices(self, pool):
+        """Fetches bid/ask prices for the pool's market from the /api/market_prices endpoint."""
+        return self._run(self.client.get_market_prices(pool))
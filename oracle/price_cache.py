@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+
+from pool_api_client import parse_event_url
+
+# How long a market price snapshot is served from memory before refetching
+MARKET_PRICE_TTL = float(os.getenv("MARKET_PRICE_TTL", "5"))
+# Oldest snapshot (seconds) that may be used to price a trade
+MARKET_PRICE_MAX_AGE = float(os.getenv("MARKET_PRICE_MAX_AGE", "30"))
+
+class StalePricesError(Exception):
+    pass
+
+class PriceSnapshot:
+    """Market prices for one event, with the time they were fetched."""
+    def __init__(self, prices, fetched_at=None):
+        self.prices = prices
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def require_fresh(self, max_age=MARKET_PRICE_MAX_AGE):
+        """Returns the prices, raising StalePricesError if they are missing or older than max_age seconds."""
+        if not self.prices:
+            raise StalePricesError("No market prices available")
+        if self.age() > max_age:
+            raise StalePricesError(f"Market prices are {self.age():.1f}s old (max {max_age}s)")
+        return self.prices
+
+class MarketPriceCache:
+    """
+    Shared market price snapshots keyed by (event_name, tid).
+
+    Snapshots are reused for `ttl` seconds. Concurrent callers asking for
+    the same event while a fetch is in flight wait on that one fetch
+    instead of starting their own.
+    """
+    def __init__(self, fetch_prices, ttl=MARKET_PRICE_TTL):
+        self.fetch_prices = fetch_prices
+        self.ttl = ttl
+        self.snapshots = {}
+        self.inflight = {}
+
+    async def get(self, pool):
+        key = tuple(parse_event_url(pool["markets"][0]))
+        snapshot = self.snapshots.get(key)
+        if snapshot is not None and snapshot.age() < self.ttl:
+            return snapshot
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, pool))
+            self.inflight[key] = task
+        # Shield so one cancelled caller does not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, pool):
+        try:
+            prices = await self.fetch_prices(pool)
+            if not prices:
+                # Keep serving the last good snapshot; its timestamp tells callers how old it is
+                return self.snapshots.get(key) or PriceSnapshot(prices)
+            snapshot = PriceSnapshot(prices)
+            self.snapshots[key] = snapshot
+            return snapshot
+        finally:
+            del self.inflight[key]
+
+    def invalidate(self, pool=None):
+        if pool is None:
+            self.snapshots.clear()
+        else:
+            self.snapshots.pop(tuple(parse_event_url(pool["markets"][0])), None)
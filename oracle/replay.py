@@ -0,0 +1,265 @@
+"""
+Record and replay oracle job traffic.
+
+Recording (set ORACLE_RECORD=session.jsonl when running main.py) writes
+every job the oracle processes and the result of every I/O call it makes
+(Pool API requests, market prices, NEAR RPC calls, NEAR AI runs) to a
+JSON-lines file.
+
+Replaying runs the recorded jobs through process_job again with all I/O
+served from the file, as fast as possible, and reports throughput and
+per-stage timings:
+
+    LOG_LEVEL=WARNING python replay.py session.jsonl [--concurrency N] [--repeat N]
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from decimal import Decimal
+
+import metrics
+from log import logger
+
+# NEAR RPC and external calls made from main.py, patched on the main module
+IO_FUNCTIONS = (
+    "handle_buy", "handle_sell", "fulfill_deposit", "fulfill_withdraw", "fulfill_ious_batch",
+    "ft_balance", "ft_total_supply", "swap_near_to_usdc", "swap_usdc_to_near", "call_near_ai_api",
+)
+# Arguments that are secrets, constant per deployment or local clock readings; left out of recordings and call keys
+UNRECORDED_ARGS = {"private_key", "owner_account_id", "newer_than"}
+
+class ReplayMissError(Exception):
+    """A call was made during replay that is not in the recording."""
+
+class ReplayedError(Exception):
+    """Stands in for an exception that was raised by a call while recording."""
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    # Transaction results and other RPC objects are never read by the oracle; keep a description
+    return repr(value)
+
+def _object_hook(value):
+    if "__decimal__" in value:
+        return Decimal(value["__decimal__"])
+    return value
+
+def encode(value):
+    return json.dumps(value, default=_default, sort_keys=True)
+
+def decode(text):
+    return json.loads(text, object_hook=_object_hook)
+
+def call_key(name, fn, args, kwargs):
+    """Identifies a call by its name and arguments, leaving out UNRECORDED_ARGS."""
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+        params = {key: value for key, value in bound.arguments.items() if key not in UNRECORDED_ARGS}
+    except TypeError:
+        params = {"args": args, "kwargs": kwargs}
+    return f"{name} {encode(params)}"
+
+class Recorder:
+    """Appends recorded calls and jobs to a JSON-lines file."""
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, entry):
+        line = encode(entry)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def wrap(self, name, fn):
+        def record(key, started, result=None, error=None):
+            entry = {"type": "call", "key": key, "elapsed": time.perf_counter() - started}
+            if error is not None:
+                entry["error"] = f"{type(error).__name__}: {error}"
+            else:
+                entry["result"] = result
+            self.write(entry)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                key = call_key(name, fn, args, kwargs)
+                started = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as e:
+                    record(key, started, error=e)
+                    raise
+                record(key, started, result)
+                return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = call_key(name, fn, args, kwargs)
+                started = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    record(key, started, error=e)
+                    raise
+                record(key, started, result)
+                return result
+        return wrapper
+
+    def wrap_job(self, fn):
+        @functools.wraps(fn)
+        async def wrapper(job):
+            self.write({"type": "job", "job": job})
+            return await fn(job)
+        return wrapper
+
+    def wrap_batch(self, fn):
+        @functools.wraps(fn)
+        async def wrapper(pool_name, jobs):
+            self.write({"type": "batch", "pool": pool_name, "jobs": jobs})
+            return await fn(pool_name, jobs)
+        return wrapper
+
+class Replayer:
+    """
+    Serves call results from a recording.
+
+    Results are matched by call key; repeated calls with the same key get
+    the recorded results in order (the last one is reused if the replay
+    asks more often than the recording did).
+    """
+    def __init__(self, entries):
+        self.results = defaultdict(deque)
+        self.last = {}
+        self.work = []
+        for entry in entries:
+            if entry["type"] == "call":
+                self.results[entry["key"]].append(entry)
+            else:
+                self.work.append(entry)
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as file:
+            return cls(decode(line) for line in file if line.strip())
+
+    def _next(self, key):
+        queue = self.results.get(key)
+        if queue:
+            entry = queue.popleft()
+            # Keep the raw entry so every replayed call gets fresh, unshared objects
+            self.last[key] = encode(entry)
+            return entry
+        if key in self.last:
+            return decode(self.last[key])
+        self.misses += 1
+        raise ReplayMissError(f"No recorded result for {key}")
+
+    def _result(self, key):
+        entry = self._next(key)
+        if "error" in entry:
+            raise ReplayedError(entry["error"])
+        return entry["result"]
+
+    def wrap(self, name, fn):
+        if inspect.iscoroutinefunction(fn):
+            async def wrapper(*args, **kwargs):
+                return self._result(call_key(name, fn, args, kwargs))
+        else:
+            def wrapper(*args, **kwargs):
+                return self._result(call_key(name, fn, args, kwargs))
+        return functools.wraps(fn)(wrapper)
+
+class PoolApiProxy:
+    """Routes every coroutine method of a Pool API client through wrap(name, method)."""
+    def __init__(self, client, wrap):
+        self._client = client
+        self._wrap = wrap
+        self._methods = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or name == "close" or not inspect.iscoroutinefunction(attr):
+            return attr
+        if name not in self._methods:
+            self._methods[name] = self._wrap(f"pool_api.{name}", attr)
+        return self._methods[name]
+
+def _patch_io(main, wrap):
+    from price_cache import MarketPriceCache
+
+    main.pool_api = PoolApiProxy(main.pool_api, wrap)
+    # The price cache holds the client's bound method, so rebuild it on the proxy
+    main.price_cache = MarketPriceCache(main.pool_api.get_market_prices)
+    for name in IO_FUNCTIONS:
+        setattr(main, name, wrap(name, getattr(main, name)))
+
+def install_recorder(main, path):
+    """Records all jobs and I/O of the given main module to path."""
+    recorder = Recorder(path)
+    _patch_io(main, recorder.wrap)
+    main.process_job = recorder.wrap_job(main.process_job)
+    main.process_fulfill_batch = recorder.wrap_batch(main.process_fulfill_batch)
+    logger.info("Recording oracle traffic to {}", path)
+    return recorder
+
+def install_replayer(main, replayer):
+    _patch_io(main, replayer.wrap)
+
+async def replay(main, replayer, concurrency=1, repeat=1):
+    """Runs the recorded jobs through the scheduler. Returns (jobs processed, seconds)."""
+    from job_scheduler import PoolJobScheduler
+
+    count = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        scheduler = PoolJobScheduler(main.process_job, concurrency=concurrency, batch_handler=main.process_fulfill_batch)
+        for entry in replayer.work:
+            if entry["type"] == "job":
+                scheduler.submit(entry["job"])
+                count += 1
+            else:
+                # Batches run outside the scheduler so they stay exactly as they were recorded
+                await scheduler.join()
+                await main.process_fulfill_batch(entry["pool"], entry["jobs"])
+                count += len(entry["jobs"])
+        await scheduler.join()
+        # runAI jobs leave NEAR AI runs going in the background
+        await main.ai_runner.join()
+    return count, time.perf_counter() - started
+
+def report(count, seconds, misses):
+    lines = [f"{count} jobs in {seconds:.3f}s ({count / seconds if seconds else 0:.1f} jobs/sec), {misses} unrecorded calls"]
+    for title, histogram in (("job", metrics.job_seconds), ("stage", metrics.stage_seconds)):
+        for key, entry in sorted(histogram.values.items()):
+            mean_ms = entry["sum"] / entry["count"] * 1000
+            lines.append(f"  {title:<5} {key[0]:<30} n={entry['count']:<6} mean={mean_ms:.3f}ms total={entry['sum']:.3f}s")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded oracle session offline.")
+    parser.add_argument("recording")
+    parser.add_argument("--concurrency", type=int, default=1, help="jobs run at once across pools")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the session this many times")
+    args = parser.parse_args()
+
+    # process_job bails out without a key; nothing is signed during replay
+    os.environ.setdefault("OWNER_PRIVATE_KEY", "replay")
+    import main as oracle_main
+
+    replayer = Replayer.load(args.recording)
+    install_replayer(oracle_main, replayer)
+    count, seconds = asyncio.run(replay(oracle_main, replayer, args.concurrency, args.repeat))
+    print(report(count, seconds, replayer.misses))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import random
+import time
+
+import metrics
+from log import logger
+
+from py_near.account import ViewFunctionError
+from py_near.exceptions import exceptions as near_exceptions
+from py_near.exceptions import provider as provider_exceptions
+
+from near_accounts import TransactionOutcomeUnknown
+
+# Errors that will fail the same way no matter how many times we retry them
+FATAL_ERRORS = (
+    ValueError,
+    ViewFunctionError,
+    near_exceptions.ActionErrorKind,
+    provider_exceptions.ActionErrorKind,
+    provider_exceptions.InvalidAccount,
+    provider_exceptions.UnknownAccount,
+    provider_exceptions.NoContractCodeError,
+    provider_exceptions.UnknownAccessKeyError,
+    TransactionOutcomeUnknown,
+)
+
+# Invalid transactions are fatal, except those fixed by re-signing with a fresh nonce or block hash
+RETRYABLE_INVALID_TX_ERRORS = (
+    provider_exceptions.InvalidNonce,
+    provider_exceptions.Expired,
+)
+
+def is_retryable(error):
+    """Returns True if the error is transient (network, RPC node, nonce) and the call may succeed on retry."""
+    if isinstance(error, RETRYABLE_INVALID_TX_ERRORS):
+        return True
+    if isinstance(error, provider_exceptions.InvalidTxError):
+        return False
+    return not isinstance(error, FATAL_ERRORS)
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, bounded by a maximum attempt count
+    and an optional overall deadline (seconds).
+    """
+    def __init__(self, max_attempts=8, base_delay=0.5, max_delay=30.0, deadline=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def delay(self, attempt):
+        """Seconds to wait after the given failed attempt (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.getenv("NEAR_RETRY_ATTEMPTS", "8")),
+    deadline=float(os.getenv("NEAR_RETRY_DEADLINE", "120")),
+)
+
+async def with_retry(description, fn, *args, policy=DEFAULT_RETRY_POLICY, **kwargs):
+    """
+    Awaits fn(*args, **kwargs), retrying transient failures according to policy.
+
+    Fatal errors are raised immediately. Once the attempts or the deadline
+    are used up, the last error is raised. If the error carries a `resend`
+    (a transaction that was sent but whose outcome is unknown, see
+    CachedAccount), the next attempt awaits that instead of calling fn
+    again, so the transaction is not signed and sent a second time.
+    """
+    stage = f"rpc {description}"
+    started = time.monotonic()
+    attempt = 0
+    call = lambda: fn(*args, **kwargs)
+    while True:
+        attempt += 1
+        try:
+            with metrics.stage_seconds.time(stage=stage):
+                return await call()
+        except Exception as e:
+            if not is_retryable(e):
+                logger.error("{} failed: {}", description, e)
+                metrics.stage_failures.inc(stage=stage)
+                raise
+            delay = policy.delay(attempt)
+            out_of_time = policy.deadline is not None and time.monotonic() - started + delay > policy.deadline
+            if attempt >= policy.max_attempts or out_of_time:
+                logger.error("{} failed after {} attempts: {}", description, attempt, e)
+                metrics.stage_failures.inc(stage=stage)
+                raise
+            logger.warning("{} failed, retrying in {:.1f}s: {}", description, delay, e)
+            metrics.retries.inc(stage=stage)
+            call = getattr(e, "resend", None) or (lambda: fn(*args, **kwargs))
+            await asyncio.sleep(delay)
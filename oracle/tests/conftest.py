@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The oracle runs from its own directory and imports its modules flat
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
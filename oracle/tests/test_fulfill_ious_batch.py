@@ -0,0 +1,78 @@
+import asyncio
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+import core_functions
+from core_functions import MAX_ACTIONS_PER_TX, fulfill_ious_batch
+from view_cache import ViewCache, view_cache
+
+def outcome(receipt_id, receipt_ids=(), status=None):
+    return SimpleNamespace(receipt_id=receipt_id, receipt_ids=list(receipt_ids), status=status or {"SuccessValue": ""})
+
+class FakeAccount:
+    """Signs nothing; answers each batch with a controller receipt that spawns one pool receipt per action."""
+    def __init__(self, failures=(), missing=(), reject=False):
+        self.failures = set(failures)
+        self.missing = set(missing)
+        self.reject = reject
+        self.transactions = []
+
+    async def sign_and_submit_tx(self, receiver_id, actions):
+        first = sum(len(batch) for batch in self.transactions)
+        self.transactions.append(actions)
+        if self.reject:
+            raise ValueError("Transaction rejected")
+        pool_ids = [f"pool-{first + i}" for i in range(len(actions))]
+        # Receipt outcomes do not come back in action order
+        outcomes = [
+            outcome(receipt_id, status={"Failure": "IOU not found"} if first + i in self.failures else None)
+            for i, receipt_id in reversed(list(enumerate(pool_ids)))
+            if first + i not in self.missing
+        ]
+        outcomes.append(outcome("controller", pool_ids))
+        return SimpleNamespace(
+            transaction_outcome=SimpleNamespace(receipt_ids=["controller"]),
+            receipt_outcome=outcomes,
+        )
+
+def fulfillments(count):
+    return [
+        ("fulfill_deposit_iou" if i % 2 == 0 else "fulfill_withdraw_iou", Decimal(1000 + i), {"iou": {"iou_id": i, "account_id": f"user{i}.testnet"}})
+        for i in range(count)
+    ]
+
+def run_batch(monkeypatch, account, count):
+    monkeypatch.setattr(core_functions, "get_account", lambda *args: account)
+    return asyncio.run(fulfill_ious_batch(fulfillments(count), "pool", "owner.testnet", "key"))
+
+def test_each_iou_gets_the_result_of_its_own_receipt(monkeypatch):
+    account = FakeAccount(failures={1, MAX_ACTIONS_PER_TX + 1})
+    results = run_batch(monkeypatch, account, MAX_ACTIONS_PER_TX + 2)
+    assert [len(actions) for actions in account.transactions] == [MAX_ACTIONS_PER_TX, 2]
+    assert [result["iou_id"] for result in results] == list(range(MAX_ACTIONS_PER_TX + 2))
+    assert [result["success"] for result in results] == [i not in (1, MAX_ACTIONS_PER_TX + 1) for i in range(MAX_ACTIONS_PER_TX + 2)]
+    assert results[1]["error"] == "IOU not found"
+    assert results[1]["method"] == "fulfill_withdraw_iou"
+
+def test_missing_receipt_fails_only_its_iou(monkeypatch):
+    results = run_batch(monkeypatch, FakeAccount(missing={2}), 4)
+    assert [result["success"] for result in results] == [True, True, False, True]
+    assert results[2]["error"] == "Receipt outcome not found"
+
+def test_rejected_transaction_fails_every_iou(monkeypatch):
+    results = run_batch(monkeypatch, FakeAccount(reject=True), 3)
+    assert not any(result["success"] for result in results)
+    assert all(result["error"] == "Transaction rejected" for result in results)
+
+def test_fulfilled_deposits_are_added_to_the_cached_supply(monkeypatch):
+    contract = "pool.smartpool.testnet"
+    for method, args in (("ft_total_supply", {}), ("ft_balance_of", {"account_id": "user0.testnet"})):
+        view_cache.put(ViewCache.key(contract, method, args), "5000", 0, view_cache.generation(contract), time.monotonic())
+    try:
+        run_batch(monkeypatch, FakeAccount(failures={2}), 3)
+        # Deposit 0 minted 1000; deposit 2 failed; 1 is a withdraw
+        assert view_cache.get(ViewCache.key(contract, "ft_total_supply", {})) == "6000"
+        assert view_cache.get(ViewCache.key(contract, "ft_balance_of", {"account_id": "user0.testnet"})) == "6000"
+    finally:
+        view_cache.invalidate(contract)
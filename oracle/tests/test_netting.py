@@ -0,0 +1,30 @@
+from decimal import Decimal
+
+from netting import YOCTO, plan_pool_flows
+
+def test_deposits_and_withdraws_share_one_value_per_token():
+    # 1200 USDC over the 500 tokens left plus the 100 the withdraw burned: VPT 2
+    plan = plan_pool_flows([10 * YOCTO], [100 * YOCTO], "1200", 500 * YOCTO, Decimal(5))
+    assert plan["value_per_token"] == Decimal(2)
+    deposit = plan["deposits"][0]
+    assert deposit["operational_fee"] == Decimal("0.1") * YOCTO
+    assert deposit["usdc"] == Decimal("49.5")
+    assert deposit["tokens"] == Decimal("24.75")
+    withdraw = plan["withdraws"][0]
+    assert withdraw["usdc"] == Decimal(200)
+    # NEAR payouts are whole yocto
+    assert withdraw["near"] == Decimal("40e24")
+    assert withdraw["near_payout"] == Decimal("39.2e24")
+    assert plan["net_usdc"] == Decimal("49.5") - Decimal(200)
+
+def test_first_deposit_issues_tokens_at_one_usdc():
+    plan = plan_pool_flows([2 * YOCTO, 4 * YOCTO], [], "0", 0, Decimal(5))
+    assert plan["value_per_token"] == Decimal(1)
+    assert [deposit["tokens"] for deposit in plan["deposits"]] == [Decimal("9.9"), Decimal("19.8")]
+    assert plan["net_usdc"] == Decimal("29.7")
+
+def test_matching_flows_net_to_zero():
+    # A deposit worth exactly what a withdraw takes out needs no swap
+    plan = plan_pool_flows([Decimal(20) / Decimal("0.99") * YOCTO], [50 * YOCTO], "1000", 450 * YOCTO, Decimal(5))
+    assert plan["withdraws"][0]["usdc"] == Decimal(100)
+    assert abs(plan["net_usdc"]) < Decimal("1e-20")
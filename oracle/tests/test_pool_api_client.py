@@ -0,0 +1,59 @@
+import asyncio
+
+from aiohttp import web
+
+from job_feed import JobFeed
+from pool_api_client import AsyncPoolApiClient
+
+HTML_ERROR = "<html><body>Bad gateway</body></html>"
+
+async def with_server(handler, check):
+    """Runs check(client) against a local Pool API whose every route is served by handler."""
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    client = AsyncPoolApiClient(f"http://127.0.0.1:{port}", timeout=5)
+    try:
+        return await check(client)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+async def html_page(request):
+    return web.Response(text=HTML_ERROR, content_type="text/html")
+
+async def empty_body(request):
+    return web.Response(body=b"")
+
+def test_fetch_jobs_with_html_body_returns_no_jobs():
+    assert asyncio.run(with_server(html_page, lambda client: client.fetch_jobs())) == []
+
+def test_fetch_jobs_with_empty_body_returns_no_jobs():
+    assert asyncio.run(with_server(empty_body, lambda client: client.fetch_jobs())) == []
+
+def test_get_pool_with_html_body_returns_none():
+    assert asyncio.run(with_server(html_page, lambda client: client.get_pool("pool"))) is None
+
+def test_writes_ignore_a_body_that_is_not_json():
+    async def check(client):
+        await client.update_job_status(1, "complete")
+        await client.record_action("pool", "SWAP", "Platform")
+        return await client.apply_pool_changes("pool", [("USDC", "1")], "BUY", "Platform")
+    assert asyncio.run(with_server(html_page, check)) is True
+
+def test_long_poll_with_html_body_fails_softly():
+    assert asyncio.run(with_server(html_page, lambda client: client.wait_for_jobs(0, 1))) is None
+
+def test_long_poll_with_empty_body_fails_softly():
+    assert asyncio.run(with_server(empty_body, lambda client: client.wait_for_jobs(0, 1))) is None
+
+def test_job_feed_falls_back_to_polling_when_long_poll_is_not_json():
+    async def check(client):
+        feed = JobFeed(client, wait=1, min_interval=0)
+        jobs = await feed.next_jobs()
+        return jobs, feed.long_poll
+    assert asyncio.run(with_server(html_page, check)) == ([], False)
@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+import pytest
+
+from valuation import PortfolioValuation
+
+HOLDINGS = {
+    "USDC": {"amount": "100"},
+    "NEAR": {"amount": "5"},
+    "Yes market": {"amount": "10", "option": "YES"},
+    "No market": {"amount": "20", "option": "NO"},
+}
+
+def test_nav_values_yes_at_bid_and_no_at_one_minus_ask():
+    market_prices = {
+        "Yes market": {"bid": "0.400", "ask": "0.450"},
+        "No market": {"bid": "0.300", "ask": "0.350"},
+    }
+    assert PortfolioValuation(HOLDINGS, market_prices).nav() == Decimal("100") + 10 * Decimal("0.4") + 20 * Decimal("0.65")
+
+def test_one_sided_book_values_unquoted_side_at_zero():
+    market_prices = {
+        "Yes market": {"bid": None, "ask": "0.450", "bids": [], "asks": [{"price": "0.45", "size": "100"}]},
+        "No market": {"bid": "0.300", "ask": None},
+    }
+    assert PortfolioValuation(HOLDINGS, market_prices).nav() == Decimal("100")
+
+def test_markets_the_pool_does_not_hold_are_not_parsed():
+    market_prices = {
+        "Yes market": {"bid": "0.400", "ask": "0.450"},
+        "No market": {"bid": "0.300", "ask": "0.350"},
+        "Other market": {"bid": "not a price", "ask": None},
+    }
+    assert PortfolioValuation(HOLDINGS, market_prices).nav() == Decimal("117")
+
+def test_rebalance_leaves_positions_without_a_bid():
+    market_prices = {
+        "Yes market": {"bid": "0.500", "ask": "0.550"},
+        "No market": {"bid": None, "ask": "0.350"},
+    }
+    new_holdings, target_usdc = PortfolioValuation(HOLDINGS, market_prices).rebalance("1", "102")
+    assert target_usdc == Decimal("102")
+    assert new_holdings["Yes market"]["amount"] == "6"
+    assert new_holdings["No market"] == HOLDINGS["No market"]
+    assert new_holdings["USDC"] == {"amount": "102"}
+    assert "NEAR" not in new_holdings
+
+def test_rebalance_without_any_bid_raises():
+    market_prices = {
+        "Yes market": {"bid": None, "ask": "0.550"},
+        "No market": {"bid": None, "ask": "0.350"},
+    }
+    with pytest.raises(ValueError):
+        PortfolioValuation(HOLDINGS, market_prices).rebalance("1", "150")
+
+def test_depth_prices_the_whole_position_and_beyond_the_book_at_the_worst_level():
+    market_prices = {
+        "Yes market": {"bid": "0.5", "ask": "0.55", "bids": [{"price": "0.4", "size": "4"}, {"price": "0.5", "size": "4"}], "asks": []},
+        "No market": {"bid": "0.3", "ask": "0.35", "bids": [], "asks": [{"price": "0.35", "size": "10"}, {"price": "0.45", "size": "10"}]},
+    }
+    valuation = PortfolioValuation(HOLDINGS, market_prices)
+    # 4 at 0.5, 4 at 0.4 and the last 2 at 0.4: 4.4 for 10 shares
+    assert valuation.bids[0] == Decimal("0.44")
+    # Buying back 20 shares averages 0.4, so a NO share is worth 0.6
+    assert valuation.prices[1] == Decimal("0.6")
+    assert valuation.nav() == Decimal("100") + Decimal("4.4") + Decimal("12")
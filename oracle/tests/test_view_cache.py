@@ -0,0 +1,42 @@
+import time
+
+from view_cache import ViewCache
+
+SUPPLY = ViewCache.key("pool.smartpool.testnet", "ft_total_supply", {})
+BALANCE = ViewCache.key("pool.smartpool.testnet", "ft_balance_of", {"account_id": "alice.testnet"})
+OTHER = ViewCache.key("other.smartpool.testnet", "ft_total_supply", {})
+
+def filled_cache():
+    cache = ViewCache(max_blocks=10, ttl=60)
+    for key in (SUPPLY, BALANCE, OTHER):
+        cache.put(key, "100", 1, cache.generation(key[0]), time.monotonic())
+    return cache
+
+def test_adjust_updates_a_view_in_place():
+    cache = filled_cache()
+    cache.adjust("pool.smartpool.testnet", "ft_total_supply", {}, lambda result: str(int(result) + 5))
+    assert cache.get(SUPPLY) == "105"
+    assert cache.get(BALANCE) == "100"
+
+def test_invalidate_drops_only_the_given_method():
+    cache = filled_cache()
+    cache.invalidate("pool.smartpool.testnet", "ft_balance_of")
+    assert cache.get(BALANCE) is None
+    assert cache.get(SUPPLY) == "100"
+    cache.invalidate("pool.smartpool.testnet")
+    assert cache.get(SUPPLY) is None
+    assert cache.get(OTHER) == "100"
+
+def test_view_in_flight_during_a_change_is_not_stored():
+    cache = ViewCache(max_blocks=10, ttl=60)
+    generation = cache.generation(SUPPLY[0])
+    cache.adjust(SUPPLY[0], "ft_total_supply", {}, lambda result: result)
+    cache.put(SUPPLY, "100", 1, generation, time.monotonic())
+    assert cache.get(SUPPLY) is None
+
+def test_newer_than_skips_results_read_before():
+    cache = ViewCache(max_blocks=10, ttl=60)
+    read_at = time.monotonic()
+    cache.put(SUPPLY, "100", 1, cache.generation(SUPPLY[0]), read_at)
+    assert cache.get(SUPPLY, newer_than=read_at) == "100"
+    assert cache.get(SUPPLY, newer_than=read_at + 1) is None
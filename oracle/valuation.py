@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+
+from order_book import OrderBook
+
+NON_MARKET_ASSETS = ("USDC", "NEAR")
+ZERO = Decimal(0)
+ONE = Decimal(1)
+# Precision of depth-weighted prices; bids round down and asks up so depth never flatters the pool
+DEPTH_PRICE_STEP = Decimal("0.000001")
+
+# Parsed market price snapshots kept, most recently used last
+PARSED_PRICES_SIZE = 64
+# Position sizes whose exit prices each quote remembers
+QUOTE_POSITIONS_SIZE = 256
+_parsed_prices = OrderedDict()
+
+def _price(value):
+    return None if value is None else Decimal(value)
+
+class Quote:
+    """
+    Top-of-book bid/ask of one asset as Decimals, plus its order book when
+    the prices carry depth. A side with no quote (null in /api/market_prices,
+    as for a one-sided book) is None.
+    """
+    def __init__(self, prices):
+        self.bid = _price(prices.get("bid"))
+        self.ask = _price(prices.get("ask"))
+        self.book = OrderBook.from_prices(prices) if "bids" in prices or "asks" in prices else None
+        self.positions = {}
+
+    def position(self, amount):
+        """(amount, bid, ask) for a holdings amount string, remembered for this snapshot."""
+        position = self.positions.get(amount)
+        if position is None:
+            if len(self.positions) >= QUOTE_POSITIONS_SIZE:
+                self.positions.clear()
+            parsed = Decimal(amount)
+            position = self.positions[amount] = (parsed, *self.exit_prices(parsed))
+        return position
+
+    def exit_prices(self, amount):
+        """
+        (bid, ask) for valuing a position of amount shares: the top of the
+        book, or with depth, the average price of selling (bid) or buying
+        back (ask, used for NO positions) the whole amount.
+        """
+        bid, ask = self.bid, self.ask
+        if self.book is not None:
+            if not self.book.bids.unlimited and self.book.bids.best() is not None:
+                bid = self.book.bids.average_price(amount).quantize(DEPTH_PRICE_STEP, rounding=ROUND_DOWN)
+            if not self.book.asks.unlimited and self.book.asks.best() is not None:
+                ask = self.book.asks.average_price(amount).quantize(DEPTH_PRICE_STEP, rounding=ROUND_UP)
+        return bid, ask
+
+class MarketQuotes:
+    """Quotes of one market prices snapshot, each parsed the first time a pool holding it is valued."""
+    def __init__(self, market_prices):
+        self.market_prices = market_prices
+        self.quotes = {}
+
+    def __getitem__(self, asset):
+        quote = self.quotes.get(asset)
+        if quote is None:
+            quote = self.quotes[asset] = Quote(self.market_prices[asset])
+        return quote
+
+def parse_prices(market_prices):
+    """
+    Quotes by asset for a market prices dict, parsed once per snapshot and
+    only for the assets that are looked up.
+
+    MarketPriceCache hands every job on the same event the same prices dict
+    until it refetches, so the parse is cached by the dict's identity (the
+    dict itself is kept alongside so its id cannot be reused meanwhile).
+    """
+    key = id(market_prices)
+    cached = _parsed_prices.get(key)
+    if cached is not None and cached[0] is market_prices:
+        _parsed_prices.move_to_end(key)
+        return cached[1]
+    quotes = MarketQuotes(market_prices)
+    _parsed_prices[key] = (market_prices, quotes)
+    if len(_parsed_prices) > PARSED_PRICES_SIZE:
+        _parsed_prices.popitem(last=False)
+    return quotes
+
+class PortfolioValuation:
+    """
+    Holdings and bid/ask prices for one pool, parsed once into parallel
+    columns (one entry per market asset) so that valuing and liquidating
+    the pool share the parse. Price strings are parsed once per market
+    price snapshot (see parse_prices), and each position's exit prices once
+    per snapshot and amount (see Quote.position).
+
+    Sums are accumulated with Decimal in the same order as the per-asset
+    loops they replaced, so the results are identical to them.
+
+    When the market prices carry order-book depth, each asset is priced at
+    what exiting its whole position would fetch (see Quote.exit_prices)
+    rather than at the top of the book.
+
+    A position whose exit side has no quote cannot be sold, so it is valued
+    at 0 and rebalancing leaves it alone.
+    """
+    def __init__(self, holdings, market_prices):
+        quotes = parse_prices(market_prices)
+        self.holdings = holdings
+        self.usdc = Decimal(holdings.get("USDC", {}).get("amount", "0"))
+        self.assets = []
+        self.amounts = []
+        self.bids = []
+        # Value of one share: the bid for YES positions, 1 - ask for NO positions (0 without a quote)
+        self.prices = []
+        for asset, holding in holdings.items():
+            if asset in NON_MARKET_ASSETS:
+                continue
+            amount, bid, ask = quotes[asset].position(holding.get("amount", "0"))
+            self.assets.append(asset)
+            self.amounts.append(amount)
+            self.bids.append(bid)
+            if holding.get("option", "YES") == "NO":
+                self.prices.append(ZERO if ask is None else ONE - ask)
+            else:
+                self.prices.append(ZERO if bid is None else bid)
+
+    def nav(self):
+        """Total pool value in USDC (same result as calculate_usdc_total_from_holdings)."""
+        total = self.usdc
+        for amount, price in zip(self.amounts, self.prices):
+            total += amount * price
+        return total
+
+    def rebalance(self, percentage_pool, portfolio_total):
+        """
+        Sells a proportional slice of every market asset so USDC covers
+        percentage_pool of portfolio_total (same result as rebalance_portfolio).
+
+        Returns (new_holdings, target_usdc).
+        """
+        target_usdc = Decimal(percentage_pool) * Decimal(portfolio_total)
+        if self.usdc >= target_usdc:
+            return self.holdings, target_usdc
+
+        usdc_shortfall = target_usdc - self.usdc
+        values = [ZERO if not bid else amount * bid for amount, bid in zip(self.amounts, self.bids)]
+        total_non_usdc_value = Decimal(0)
+        for value in values:
+            total_non_usdc_value += value
+        if not total_non_usdc_value:
+            raise ValueError(f"No market asset has a bid to sell for the {usdc_shortfall} USDC shortfall")
+
+        new_holdings = self.holdings.copy()
+        for asset, amount, bid, value in zip(self.assets, self.amounts, self.bids, values):
+            if not value:
+                continue
+            amount_to_sell = usdc_shortfall * (value / total_non_usdc_value) / bid
+            new_holdings[asset] = {**self.holdings[asset], "amount": str((amount - amount_to_sell).quantize(Decimal("1"), rounding=ROUND_DOWN))}
+
+        new_holdings["USDC"] = {"amount": str(self.usdc + usdc_shortfall)}
+        new_holdings.pop("NEAR", None)
+        return new_holdings, target_usdc
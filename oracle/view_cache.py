@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+from retry import with_retry
+
+# A cached view result is reused while it is at most this many blocks behind
+# the newest block we have seen and younger than VIEW_CACHE_TTL seconds.
+VIEW_CACHE_BLOCKS = int(os.getenv("VIEW_CACHE_BLOCKS", "10"))
+VIEW_CACHE_TTL = float(os.getenv("VIEW_CACHE_TTL", "10"))
+
+class ViewCache:
+    """
+    Cache for contract view results keyed by (contract, method, args).
+
+    When the oracle changes a contract's state itself, the views it knows
+    the new result of are updated in place (see adjust) and the others it
+    may have changed are dropped (see invalidate). Each contract has a
+    generation counter so a view that was already in flight at the change
+    is not stored.
+    """
+    def __init__(self, max_blocks=VIEW_CACHE_BLOCKS, ttl=VIEW_CACHE_TTL):
+        self.max_blocks = max_blocks
+        self.ttl = ttl
+        self.entries = {}
+        self.generations = {}
+        self.latest_block_height = 0
+
+    @staticmethod
+    def key(contract, method, args):
+        return (contract, method, json.dumps(args, sort_keys=True))
+
+    def generation(self, contract):
+        return self.generations.get(contract, 0)
+
+    def get(self, key, newer_than=None):
+        """The cached result, or None if it is stale or was read before the monotonic time newer_than."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        result, block_height, read_at = entry
+        if time.monotonic() - read_at > self.ttl or self.latest_block_height - block_height > self.max_blocks:
+            del self.entries[key]
+            return None
+        if newer_than is not None and read_at < newer_than:
+            return None
+        return result
+
+    def put(self, key, result, block_height, generation, read_at):
+        self.latest_block_height = max(self.latest_block_height, block_height or 0)
+        if generation != self.generation(key[0]):
+            return
+        self.entries[key] = (result, block_height or 0, read_at)
+
+    def invalidate(self, contract, method=None, args=None):
+        """Drops the cached views of the contract (only those of method, and args, if given)."""
+        self.generations[contract] = self.generation(contract) + 1
+        for key in [key for key in self.entries if key[0] == contract and method in (None, key[1])]:
+            if args is None or key == self.key(contract, method, args):
+                del self.entries[key]
+
+    def adjust(self, contract, method, args, change):
+        """Replaces a cached view result with change(result) after the oracle's own transaction changed it."""
+        self.generations[contract] = self.generation(contract) + 1
+        key = self.key(contract, method, args)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries[key] = (change(entry[0]), *entry[1:])
+
+view_cache = ViewCache()
+
+async def cached_view_function(account, contract, method, args, refresh=False, newer_than=None):
+    """
+    Calls a contract view method through the shared cache, retrying transient RPC failures.
+    Pass refresh=True when the state may have changed outside the oracle, or
+    newer_than (a time.monotonic() value) when it changed outside the oracle
+    before then.
+    """
+    key = ViewCache.key(contract, method, args)
+    result = None if refresh else view_cache.get(key, newer_than)
+    if result is not None:
+        return result
+    generation = view_cache.generation(contract)
+    read_at = time.monotonic()
+    response = await with_retry(
+        method,
+        account.view_function,
+        contract,
+        method,
+        args=args,
+    )
+    view_cache.put(key, response.result, response.block_height, generation, read_at)
+    return response.result